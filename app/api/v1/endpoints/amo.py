@@ -1,17 +1,15 @@
-import urllib
-
 from typing import Any
 
-from fastapi import APIRouter, Body, BackgroundTasks, Request, Depends
+from fastapi import APIRouter, Body, Depends, Request
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from app.core import get_db
-from app.core.config import red
-from app.core.db import SessionLocal
+from app.core import get_async_db
+from app.job.hooks import HookQueue
+from app.job.sync import catalog_job, catalog_full_job, leads_job, sync_lock, sync_leads_lock
 from app.repository.amocrm import AmoRepo
 from app.repository.tgbot import Alert
-from app.schemas import LeadAddItemRequest, AMODTProduct, LeadSyncItemsRequest, parse_dt_product_update
-from app.schemas.lead import parse_lead_update
-from app.services import NotionService, AMOService
+from app.schemas import LeadAddItemRequest, AMODTProduct, LeadSyncItemsRequest
+from app.services import CatalogService
 
 router = APIRouter()
 
@@ -30,11 +28,11 @@ def docs(
     '/sync-leads-full',
     description='Принудительное обновление всех сделок с Notion -> AmoCRM',
 )
-def sync_leads_full(background_tasks: BackgroundTasks):
-    if red.get('sync-leads-running') is not None:
+def sync_leads_full():
+    # синхронизации выполняет планировщик, API только заказывает запуск
+    if sync_leads_lock().locked():
         return 'Запрос проигнорирован. Процесс полного обновления лидов уже был запущен недавно.'
-    red.set('sync-leads-running', '1')
-    background_tasks.add_task(NotionService.sync_leads)
+    leads_job.trigger()
     return 'Процесс обновления сделок запущен.'
 
 
@@ -42,11 +40,10 @@ def sync_leads_full(background_tasks: BackgroundTasks):
     '/sync-catalog-full',
     description='Принудительная синхронизация всего каталога с amoCRM',
 )
-def sync_catalog(background_tasks: BackgroundTasks):
-    if red.get('sync-running') is not None:
+def sync_catalog():
+    if sync_lock().locked():
         return 'Запрос проигнорирован. Процесс полного обновления уже был запущен недавно.'
-    red.set('sync-running', '1')
-    background_tasks.add_task(NotionService.sync_with_amo, True)
+    catalog_full_job.trigger()
     return 'Процесс полного обновления запущен.'
 
 
@@ -54,11 +51,10 @@ def sync_catalog(background_tasks: BackgroundTasks):
     '/sync-catalog-edited',
     description='Принудительная синхронизация обновлённых записей каталога с amoCRM',
 )
-def sync_catalog_updated(background_tasks: BackgroundTasks):
-    if red.get('sync-running') is not None:
+def sync_catalog_updated():
+    if sync_lock().locked():
         return 'Запрос проигнорирован. Процесс обновления уже был запущен недавно.'
-    red.set('sync-running', '1')
-    background_tasks.add_task(NotionService.sync_with_amo)
+    catalog_job.trigger()
     return 'Процесс обновления запущен.'
 
 
@@ -68,20 +64,11 @@ def sync_catalog_updated(background_tasks: BackgroundTasks):
 )
 async def process_data(
         request: Request,
-        background_tasks: BackgroundTasks,
 ):
     body_bytes = await request.body()
-    body_str = body_bytes.decode('utf-8')
-    decoded_data = urllib.parse.parse_qs(body_str)  # noqa
-    def process():
-        db = next(iter(get_db()))
-        try:
-            lead = parse_lead_update(decoded_data)
-            if lead is not None:
-                AMOService(db).process_lead_update_hook(lead)
-        finally:
-            db.close()
-    background_tasks.add_task(process)
+    lead_id = await HookQueue.lead_key(body_bytes)
+    if lead_id is not None:
+        await HookQueue.apush(HookQueue.lead_update, body_bytes, lead_id)
     return {
         'success': True
     }
@@ -96,7 +83,7 @@ def lead_add_item(
 ):
     success = True
     try:
-        bt_item = AmoRepo.get_product_by_nid(body.item_nid)
+        bt_item = CatalogService.get_product_by_nid(body.item_nid)
         dt_item = AMODTProduct.from_item(bt_item, int(bt_item.amo_id), body)
         dt_item = AmoRepo.add_dt_product(dt_item)
         AmoRepo.attach_item_to_lead(body.lead_id, dt_item.id, 1)
@@ -116,18 +103,10 @@ def lead_add_item(
 )
 def lead_sync_items(
         body: LeadSyncItemsRequest,
-        db: SessionLocal = Depends(get_db),
 ):
-    success = True
-    try:
-        AMOService(db).sync_lead_items(body.lead_id)
-    except Exception as ex:
-        success = False
-        Alert.critical(f'⛔️Ошибка при синхронизация товаров сделки\n'
-                       f'[Сделка:](https://ceh.amocrm.ru/leads/detail/{body.lead_id})`'
-                       f'\n\n{ex}')
+    HookQueue.push(HookQueue.sync_lead_items, str(body.lead_id).encode(), body.lead_id)
     return {
-        'success': success,
+        'success': True,
     }
 
 
@@ -135,15 +114,11 @@ def lead_sync_items(
     '/item-update',
     description='Хук для обновления товара сделки в amoCRM',
 )
-async def process_data(request: Request, db: SessionLocal = Depends(get_db)):
+async def process_data(request: Request, db: AsyncSession = Depends(get_async_db)):
     body_bytes = await request.body()
-    body_str = body_bytes.decode('utf-8')
-    decoded_data = urllib.parse.parse_qs(body_str)  # noqa
-    added, updated, deleted = parse_dt_product_update(decoded_data)
-    try:
-        AMOService(db).process_dt_products_update(added, updated, deleted)
-    except Exception as ex:
-        Alert.critical(f'⛔️Ошибка при обновлении товаров сделки:\n\n{ex}')
+    key = await HookQueue.items_key(body_bytes, db)
+    if key is not None:
+        await HookQueue.apush(HookQueue.item_update, body_bytes, key)
     return {
         'success': True,
     }
@@ -1,2 +1,2 @@
 from .config import settings
-from .db import get_db
+from .db import get_db, get_async_db
@@ -1,6 +1,7 @@
 from __future__ import annotations
 
 import redis
+import redis.asyncio
 
 from redis.client import Redis
 
@@ -20,6 +21,10 @@ class Settings(BaseSettings):
         dev = 'dev'
         prod = 'prod'
 
+    class MissedRuns(str, Enum):
+        skip = 'skip'  # пропущенные тики не догоняем, ждём следующий
+        run = 'run'  # сразу один запуск вместо всех пропущенных
+
     PROJECT_NAME: str = 'Cehcom API'
 
     # URI settings
@@ -40,8 +45,23 @@ class Settings(BaseSettings):
     AMOCRM_ACCESS_TOKEN: str = ''
     AMOCRM_REFRESH_TOKEN: str = ''
 
+    # AMOCRM transport
+    AMOCRM_POOL_SIZE: int = 10
+    AMOCRM_CONNECT_TIMEOUT: float = 5
+    AMOCRM_READ_TIMEOUT: float = 30
+    AMOCRM_RATE_LIMIT: float = 7  # запросов в секунду на интеграцию
+    AMOCRM_RATE_BURST: int = 7
+    AMOCRM_FETCH_CONCURRENCY: int = 5
+    AMOCRM_MIRROR_REFRESH_SECONDS: int = 600
+    AMOCRM_NID_MISS_TTL: int = 300
+
     # Notion secrets
     NOTION_SECRET: str
+    NOTION_CONCURRENCY: int = 3
+    NOTION_CACHE_SIZE: int = 5000
+    NOTION_CACHE_TTL: int = 3600
+    NOTION_DRAFT_LOCK_TIMEOUT: float = 60
+    NOTION_LEAD_HASH_TTL: int = 30 * 24 * 3600  # сделку, которая столько не менялась в Notion, забываем
 
     # Telegram
     TG_TOKEN: str
@@ -49,6 +69,28 @@ class Settings(BaseSettings):
     # Redis
     REDIS_HOST: str = 'redis'
 
+    # amoCRM hooks queue
+    HOOKS_PARTITIONS: int = 8
+    HOOKS_MAX_ATTEMPTS: int = 5
+    HOOKS_RETRY_DELAY: float = 2
+    HOOKS_STREAM_MAXLEN: int = 100_000
+    HOOKS_CLAIM_IDLE_MS: int = 60_000
+    HOOKS_DEBOUNCE_SECONDS: float = 5
+    HOOKS_DEBOUNCE_WORKERS: int = 4
+    HOOKS_DEBOUNCE_LEASE_SECONDS: int = 300
+
+    # event loop watchdog
+    LOOP_LAG_INTERVAL: float = 0.5
+    LOOP_LAG_THRESHOLD: float = 0.1
+
+    # sync jobs
+    SYNC_LEASE_SECONDS: float = 60
+    SYNC_CATALOG_INTERVAL: float = 10
+    SYNC_LEADS_INTERVAL: float = 10
+    SCHEDULER_JITTER: float = 1
+    SCHEDULER_MISSED_RUNS: MissedRuns = MissedRuns.skip
+    SCHEDULER_TRIGGER_TTL: float = 600
+
     # Database settings
     POSTGRES_USER: str
     POSTGRES_PASSWORD: str
@@ -57,9 +99,17 @@ class Settings(BaseSettings):
     POSTGRES_PORT: int
     POSTGRES_ECHO: bool
     SQLALCHEMY_DATABASE_URI: PostgresDsn | None = None
+    # на процесс: потоки воркеров хуков и планировщика берут соединения из синхронного пула,
+    # async-эндпоинты API делят небольшой пул на один event loop
+    POSTGRES_POOL_SIZE: int = 15
+    POSTGRES_MAX_OVERFLOW: int = 10
+    POSTGRES_ASYNC_POOL_SIZE: int = 10
+    POSTGRES_ASYNC_MAX_OVERFLOW: int = 10
 
     # files
     UPLOAD_DIR: str = 'media'
+    MEDIA_POOL_SIZE: int = 10
+    MEDIA_WORKERS: int = 8
 
     # default photo link
     DEFAULT_PHOTO: str = 'https://api.cehcom.kz/media/default.jpg'
@@ -81,3 +131,5 @@ class Settings(BaseSettings):
 
 settings = Settings()
 red: Redis = redis.Redis(host=settings.REDIS_HOST, port=6379, db=0)
+# для async-хендлеров: запросы в redis не блокируют event loop
+ared: redis.asyncio.Redis = redis.asyncio.Redis(host=settings.REDIS_HOST, port=6379, db=0)
@@ -1,17 +1,36 @@
+from functools import cache
+
 from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.orm import sessionmaker
 
 from app.core.config import settings
 
+# синхронный движок - для фоновых воркеров и планировщика, где задачи идут в потоках
 engine = create_engine(
     settings.SQLALCHEMY_DATABASE_URI,
-    pool_size=25,
-    max_overflow=20,
+    pool_size=settings.POSTGRES_POOL_SIZE,
+    max_overflow=settings.POSTGRES_MAX_OVERFLOW,
+    pool_pre_ping=True,
     connect_args={'application_name': settings.PROJECT_NAME},
     echo=settings.POSTGRES_ECHO,
 )
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# асинхронный движок - для async-эндпоинтов, ожидание бд не блокирует event loop.
+# Создаётся при первом запросе: воркеру и планировщику драйвер asyncpg не нужен
+@cache
+def get_async_sessionmaker() -> async_sessionmaker[AsyncSession]:
+    async_engine = create_async_engine(
+        settings.SQLALCHEMY_DATABASE_URI.replace('postgresql://', 'postgresql+asyncpg://', 1),
+        pool_size=settings.POSTGRES_ASYNC_POOL_SIZE,
+        max_overflow=settings.POSTGRES_ASYNC_MAX_OVERFLOW,
+        pool_pre_ping=True,
+        connect_args={'server_settings': {'application_name': settings.PROJECT_NAME}},
+        echo=settings.POSTGRES_ECHO,
+    )
+    return async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False, class_=AsyncSession)
+
 
 def get_db():
     db = SessionLocal()
@@ -19,3 +38,8 @@ def get_db():
         yield db
     finally:
         db.close()
+
+
+async def get_async_db():
+    async with get_async_sessionmaker()() as db:
+        yield db
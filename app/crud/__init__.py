@@ -1,3 +1,6 @@
-from .lead import lead
-from .lead_item import lead_item
+from ._crud import end_read, unit_of_work
+from ._crud_async import async_unit_of_work
+from .lead import lead, lead_async
+from .lead_item import lead_item, lead_item_async
+from .amo_product import amo_product
 
@@ -1,6 +1,9 @@
-from typing import Any, Generic, Type, TypeVar
+from contextlib import contextmanager
+from typing import Any, Generic, Iterator, Type, TypeVar
 from fastapi.encoders import jsonable_encoder
 from pydantic import BaseModel
+from sqlalchemy import update
+from sqlalchemy.dialects.postgresql import Insert, insert
 from sqlalchemy.orm import Session
 
 from app.crud.models.base import Base
@@ -10,10 +13,76 @@ CreateSchemaType = TypeVar('CreateSchemaType', bound=BaseModel)
 UpdateSchemaType = TypeVar('UpdateSchemaType', bound=BaseModel)
 
 
+@contextmanager
+def unit_of_work(db: Session) -> Iterator[Session]:
+    """
+    Одна транзакция на весь блок: CRUD-методы внутри только делают flush, commit - один в конце,
+    при исключении откат. Вложенный вызов переиспользует внешний.
+    Внешние вызовы (notion, amoCRM) внутрь блока не кладём: транзакция держала бы строки.
+    """
+    if db.info.get('uow'):
+        yield db
+        return
+    db.info['uow'] = True
+    try:
+        yield db
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.info.pop('uow', None)
+
+
+def end_read(db: Session):
+    """
+    Закрывает читающую транзакцию, чтобы она не держала соединение на время ожидания
+    или внешних вызовов. Внутри unit_of_work ничего не делает: транзакцией владеет он.
+    """
+    if not db.info.get('uow'):
+        db.rollback()
+
+
+def upsert_statements(model: Type[ModelType],
+                      objs_in: list[BaseModel],
+                      index_elements: list[str] | None = None,
+                      chunk_size: int = 500) -> Iterator[Insert]:
+    """
+    INSERT ... ON CONFLICT DO UPDATE пачками по chunk_size строк.
+    Конфликт ищется по index_elements (по умолчанию первичный ключ), обновляются
+    все переданные поля и колонки с onupdate.
+    """
+    if len(objs_in) == 0:
+        return
+    if index_elements is None:
+        index_elements = [column.name for column in model.__table__.primary_key]
+    rows = [obj.model_dump() for obj in objs_in]
+    # одна строка на ключ, иначе ON CONFLICT упадёт на повторном обновлении той же строки
+    rows = list({tuple(row[key] for key in index_elements): row for row in rows}.values())
+    for i in range(0, len(rows), chunk_size):
+        stmt = insert(model).values(rows[i:i + chunk_size])
+        set_ = {
+            name: stmt.excluded[name]
+            for name in rows[0] if name not in index_elements
+        }
+        for column in model.__table__.columns:
+            if column.onupdate is not None and column.name not in set_:
+                set_[column.name] = column.onupdate.arg
+        yield stmt.on_conflict_do_update(index_elements=index_elements, set_=set_)
+
+
 class CRUDBase(Generic[ModelType, CreateSchemaType, UpdateSchemaType]):
     def __init__(self, model: Type[ModelType]):
         self.model = model
 
+    @staticmethod
+    def _commit(db: Session):
+        """Внутри unit_of_work только flush, фиксирует транзакцию сам unit_of_work."""
+        if db.info.get('uow'):
+            db.flush()
+        else:
+            db.commit()
+
     def get(self, db: Session, id: Any) -> ModelType | None:
         return db.query(self.model).filter(self.model.id == id).first()  # noqa
 
@@ -33,7 +102,7 @@ class CRUDBase(Generic[ModelType, CreateSchemaType, UpdateSchemaType]):
         db_obj = self.model(**obj_in_data)  # type: ignore
         db.add(db_obj)
         if commit:
-            db.commit()
+            CRUDBase._commit(db)
             db.refresh(db_obj)
         return db_obj
 
@@ -55,27 +124,27 @@ class CRUDBase(Generic[ModelType, CreateSchemaType, UpdateSchemaType]):
                 setattr(db_obj, field, update_data[field])
         db.add(db_obj)
         if commit:
-            db.commit()
+            CRUDBase._commit(db)
             db.refresh(db_obj)
         return db_obj
 
     def remove(self, db: Session, *, obj_id: int) -> ModelType:
         obj = db.query(self.model).get(obj_id)
         db.delete(obj)
-        db.commit()
+        CRUDBase._commit(db)
         return obj
 
     @staticmethod
     def remove_by_obj(db: Session, *, db_obj: ModelType) -> ModelType:
         db.delete(db_obj)
-        db.commit()
+        CRUDBase._commit(db)
         return db_obj
 
     @staticmethod
     def create_instance(db: Session,
                         obj: ModelType) -> ModelType:
         db.add(obj)
-        db.commit()
+        CRUDBase._commit(db)
         db.refresh(obj)
         return obj
 
@@ -85,5 +154,30 @@ class CRUDBase(Generic[ModelType, CreateSchemaType, UpdateSchemaType]):
                     commit: bool = True) -> list[ModelType]:
         db.bulk_save_objects(objs)
         if commit:
-            db.commit()
+            CRUDBase._commit(db)
         return objs
+
+    def upsert_many(self,
+                    db: Session,
+                    objs_in: list[CreateSchemaType],
+                    index_elements: list[str] | None = None,
+                    commit: bool = True,
+                    chunk_size: int = 500):
+        """INSERT ... ON CONFLICT DO UPDATE пачками по chunk_size строк, см. upsert_statements."""
+        if len(objs_in) == 0:
+            return
+        for stmt in upsert_statements(self.model, objs_in, index_elements, chunk_size):
+            db.execute(stmt)
+        if commit:
+            CRUDBase._commit(db)
+
+    def update_many(self,
+                    db: Session,
+                    rows: list[dict[str, Any]],
+                    commit: bool = True):
+        """Bulk UPDATE по первичному ключу: каждая строка содержит pk и обновляемые поля."""
+        if len(rows) == 0:
+            return
+        db.execute(update(self.model), rows)
+        if commit:
+            CRUDBase._commit(db)
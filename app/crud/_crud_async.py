@@ -0,0 +1,106 @@
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Generic, Type
+
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.crud._crud import CreateSchemaType, ModelType, UpdateSchemaType, upsert_statements
+
+
+@asynccontextmanager
+async def async_unit_of_work(db: AsyncSession) -> AsyncIterator[AsyncSession]:
+    """unit_of_work для AsyncSession: один commit на весь блок, при исключении откат."""
+    if db.info.get('uow'):
+        yield db
+        return
+    db.info['uow'] = True
+    try:
+        yield db
+        await db.commit()
+    except Exception:
+        await db.rollback()
+        raise
+    finally:
+        db.info.pop('uow', None)
+
+
+class AsyncCRUDBase(Generic[ModelType, CreateSchemaType, UpdateSchemaType]):
+    """Те же запросы, что в CRUDBase, через AsyncSession - для async-эндпоинтов."""
+
+    def __init__(self, model: Type[ModelType]):
+        self.model = model
+
+    @staticmethod
+    async def _commit(db: AsyncSession):
+        """Внутри async_unit_of_work только flush, фиксирует транзакцию сам async_unit_of_work."""
+        if db.info.get('uow'):
+            await db.flush()
+        else:
+            await db.commit()
+
+    async def get(self, db: AsyncSession, id: Any) -> ModelType | None:
+        return await db.get(self.model, id)
+
+    async def get_multi(self, db: AsyncSession) -> list[ModelType]:
+        result = await db.scalars(select(self.model))
+        return list(result.all())
+
+    async def create(
+            self,
+            db: AsyncSession,
+            obj_in: CreateSchemaType,
+            commit: bool = True,
+    ) -> ModelType:
+        db_obj = self.model(**obj_in.model_dump())
+        db.add(db_obj)
+        if commit:
+            await AsyncCRUDBase._commit(db)
+            await db.refresh(db_obj)
+        return db_obj
+
+    async def update(
+            self,
+            db: AsyncSession,
+            *,
+            db_obj: ModelType,
+            obj_in: UpdateSchemaType | dict[str, Any],
+            commit: bool = True,
+    ) -> ModelType:
+        if isinstance(obj_in, dict):
+            update_data = obj_in
+        else:
+            update_data = obj_in.model_dump(exclude_unset=True)
+        # поля берём из таблицы, а не из объекта: чтение атрибутов AsyncSession может уйти в бд
+        for field in self.model.__table__.columns.keys():
+            if field in update_data:
+                setattr(db_obj, field, update_data[field])
+        db.add(db_obj)
+        if commit:
+            await AsyncCRUDBase._commit(db)
+            await db.refresh(db_obj)
+        return db_obj
+
+    async def upsert_many(self,
+                          db: AsyncSession,
+                          objs_in: list[CreateSchemaType],
+                          index_elements: list[str] | None = None,
+                          commit: bool = True,
+                          chunk_size: int = 500):
+        """INSERT ... ON CONFLICT DO UPDATE пачками по chunk_size строк, см. upsert_statements."""
+        if len(objs_in) == 0:
+            return
+        for stmt in upsert_statements(self.model, objs_in, index_elements, chunk_size):
+            await db.execute(stmt)
+        if commit:
+            await AsyncCRUDBase._commit(db)
+
+    async def update_many(self,
+                          db: AsyncSession,
+                          rows: list[dict[str, Any]],
+                          commit: bool = True):
+        """Bulk UPDATE по первичному ключу: каждая строка содержит pk и обновляемые поля."""
+        if len(rows) == 0:
+            return
+        await db.execute(update(self.model), rows)
+        if commit:
+            await AsyncCRUDBase._commit(db)
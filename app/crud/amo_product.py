@@ -0,0 +1,60 @@
+from datetime import datetime
+
+from sqlalchemy import func, select
+
+from ._crud import CRUDBase
+from .models.amo_product import AmoProduct
+from .schemas import AmoProductCreate, AmoProductUpdate
+from ..core.db import SessionLocal
+
+
+class CRUDAmoProduct(CRUDBase[AmoProduct, AmoProductCreate, AmoProductUpdate]):
+
+    def get_by_nids(self, db: SessionLocal, nids: list[str]) -> list[AmoProduct]:
+        if len(nids) == 0:
+            return []
+        return db.query(self.model).filter(
+            self.model.nid.in_(nids),
+        ).all()
+
+    def is_empty(self, db: SessionLocal) -> bool:
+        return db.query(self.model.amo_id).first() is None
+
+    @staticmethod
+    def now(db: SessionLocal) -> datetime:
+        """Время по часам бд, в тех же единицах, что и updated_at."""
+        return db.scalar(select(func.now()))
+
+    def get_hashes(self, db: SessionLocal) -> dict[int, str]:
+        data = db.query(
+            self.model.amo_id,
+            self.model.data_hash,
+        ).all()
+        return dict(data)
+
+    def get_payload_hashes(self, db: SessionLocal, amo_ids: list[int]) -> dict[int, str | None]:
+        if len(amo_ids) == 0:
+            return {}
+        data = db.query(
+            self.model.amo_id,
+            self.model.payload_hash,
+        ).filter(
+            self.model.amo_id.in_(amo_ids),
+        ).all()
+        return dict(data)
+
+    def delete_by_amo_ids(self, db: SessionLocal, amo_ids: list[int], updated_before: datetime | None = None) -> int:
+        """updated_before - не трогать строки, записанные с этого момента."""
+        if len(amo_ids) == 0:
+            return 0
+        query = db.query(self.model).filter(
+            self.model.amo_id.in_(amo_ids),
+        )
+        if updated_before is not None:
+            query = query.filter(self.model.updated_at < updated_before)
+        count = query.delete(synchronize_session=False)
+        self._commit(db)
+        return count
+
+
+amo_product = CRUDAmoProduct(AmoProduct)
@@ -1,8 +1,20 @@
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
 from ._crud import CRUDBase
+from ._crud_async import AsyncCRUDBase
 from .models.lead import Lead
 from .schemas import LeadCreate, LeadUpdate
 
 
+def _hash_rows(hashes: dict[int, str]) -> list[dict]:
+    """hashes: id -> data_hash"""
+    return [
+        {'id': id, 'data_hash': data_hash}
+        for id, data_hash in hashes.items()
+    ]
+
+
 class CRUDLead(CRUDBase[Lead, LeadCreate, LeadUpdate]):
 
     def get_by_amo_id(self, db, amo_id) -> Lead | None:
@@ -10,13 +22,11 @@ class CRUDLead(CRUDBase[Lead, LeadCreate, LeadUpdate]):
             self.model.amo_id == amo_id,
         ).first()
 
-    def update_hash(self, db, id: int, data_hash: str):
-        db.query(self.model).filter(
-            self.model.id == id,
-        ).update(
-            {'data_hash': data_hash},
-        )
-        db.commit()
+    def update_hashes(self, db, hashes: dict[int, str], commit: bool = True):
+        self.update_many(db, _hash_rows(hashes), commit=commit)
+
+    def upsert_by_amo_id(self, db, objs_in: list[LeadCreate], commit: bool = True):
+        self.upsert_many(db, objs_in, index_elements=['amo_id'], commit=commit)
 
     def get_uid_by_amo_id(self, db, amo_id: int) -> str | None:
         return db.query(
@@ -26,4 +36,19 @@ class CRUDLead(CRUDBase[Lead, LeadCreate, LeadUpdate]):
         ).first()[0]
 
 
+class AsyncCRUDLead(AsyncCRUDBase[Lead, LeadCreate, LeadUpdate]):
+
+    async def get_by_amo_id(self, db: AsyncSession, amo_id: int) -> Lead | None:
+        return await db.scalar(select(self.model).where(
+            self.model.amo_id == amo_id,
+        ))
+
+    async def update_hashes(self, db: AsyncSession, hashes: dict[int, str], commit: bool = True):
+        await self.update_many(db, _hash_rows(hashes), commit=commit)
+
+    async def upsert_by_amo_id(self, db: AsyncSession, objs_in: list[LeadCreate], commit: bool = True):
+        await self.upsert_many(db, objs_in, index_elements=['amo_id'], commit=commit)
+
+
 lead = CRUDLead(Lead)
+lead_async = AsyncCRUDLead(Lead)
@@ -1,9 +1,29 @@
+from sqlalchemy import delete, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
 from ._crud import CRUDBase
+from ._crud_async import AsyncCRUDBase
 from .models.lead_item import LeadItem
 from .schemas import LeadItemCreate, LeadItemUpdate
 from ..core.db import SessionLocal
 
 
+def _quantity_rows(quantities: dict[tuple[int, int], int]) -> list[dict]:
+    """quantities: (lead_id, item_id) -> quantity"""
+    return [
+        {'lead_id': lead_id, 'item_id': item_id, 'quantity': quantity}
+        for (lead_id, item_id), quantity in quantities.items()
+    ]
+
+
+def _hash_rows(hashes: dict[tuple[int, int], str]) -> list[dict]:
+    """hashes: (lead_id, item_id) -> data_hash"""
+    return [
+        {'lead_id': lead_id, 'item_id': item_id, 'data_hash': data_hash}
+        for (lead_id, item_id), data_hash in hashes.items()
+    ]
+
+
 class CRUDLeadItem(CRUDBase[LeadItem, LeadItemCreate, LeadItemUpdate]):
 
     def get_by_lead_id(self, db: SessionLocal, lead_id: int) -> list[(int, int)]:
@@ -38,23 +58,11 @@ class CRUDLeadItem(CRUDBase[LeadItem, LeadItemCreate, LeadItemUpdate]):
         ]
         return data
 
-    def update_quantity(self, db: SessionLocal, lead_id: int, item_id: int, quantity: int):
-        db.query(self.model).filter(
-            self.model.lead_id == lead_id,
-            self.model.item_id == item_id,
-        ).update(
-            {'quantity': quantity},
-        )
-        db.commit()
+    def update_quantities(self, db: SessionLocal, quantities: dict[tuple[int, int], int], commit: bool = True):
+        self.update_many(db, _quantity_rows(quantities), commit=commit)
 
-    def update_hash(self, db: SessionLocal, lead_id: int, item_id: int, data_hash: str):
-        db.query(self.model).filter(
-            self.model.lead_id == lead_id,
-            self.model.item_id == item_id,
-        ).update(
-            {'data_hash': data_hash},
-        )
-        db.commit()
+    def update_hashes(self, db: SessionLocal, hashes: dict[tuple[int, int], str], commit: bool = True):
+        self.update_many(db, _hash_rows(hashes), commit=commit)
 
     def get_by_item_ids(self, db: SessionLocal, item_ids: list[int]) -> list[LeadItem]:
         if len(item_ids) == 0:
@@ -67,10 +75,39 @@ class CRUDLeadItem(CRUDBase[LeadItem, LeadItemCreate, LeadItemUpdate]):
         return data
 
     def delete_by_item_ids(self, db: SessionLocal, item_ids: list[int]):
+        if len(item_ids) == 0:
+            return
         db.query(self.model).filter(
             self.model.item_id.in_(item_ids),
         ).delete(synchronize_session=False)
-        db.commit()
+        self._commit(db)
+
+
+class AsyncCRUDLeadItem(AsyncCRUDBase[LeadItem, LeadItemCreate, LeadItemUpdate]):
+
+    async def update_quantities(self, db: AsyncSession, quantities: dict[tuple[int, int], int],
+                                commit: bool = True):
+        await self.update_many(db, _quantity_rows(quantities), commit=commit)
+
+    async def update_hashes(self, db: AsyncSession, hashes: dict[tuple[int, int], str], commit: bool = True):
+        await self.update_many(db, _hash_rows(hashes), commit=commit)
+
+    async def get_by_item_ids(self, db: AsyncSession, item_ids: list[int]) -> list[LeadItem]:
+        if len(item_ids) == 0:
+            return []
+        result = await db.scalars(select(self.model).where(
+            self.model.item_id.in_(item_ids),
+        ))
+        return list(result.all())
+
+    async def delete_by_item_ids(self, db: AsyncSession, item_ids: list[int]):
+        if len(item_ids) == 0:
+            return
+        await db.execute(delete(self.model).where(
+            self.model.item_id.in_(item_ids),
+        ).execution_options(synchronize_session=False))
+        await self._commit(db)
 
 
 lead_item = CRUDLeadItem(LeadItem)
+lead_item_async = AsyncCRUDLeadItem(LeadItem)
@@ -0,0 +1,42 @@
+from sqlalchemy import Column, String, BigInteger, DateTime, func
+from sqlalchemy.dialects.postgresql import JSONB
+
+from .mixin import CreatedAtMixin
+
+
+class AmoProduct(CreatedAtMixin):
+    __tablename__ = 'amo_product'
+
+    amo_id = Column(
+        BigInteger,
+        primary_key=True,
+        nullable=False,
+    )
+    nid = Column(
+        String,
+        index=True,
+        nullable=False,
+    )
+    notion_id = Column(
+        String,
+        nullable=True,
+    )
+    data = Column(
+        JSONB,
+        nullable=False,
+    )
+    data_hash = Column(
+        String,
+        nullable=False,
+    )
+    # отпечаток последнего отправленного в amoCRM payload, NULL - товар менялся в обход нас
+    payload_hash = Column(
+        String,
+        nullable=True,
+    )
+    updated_at = Column(
+        DateTime,
+        nullable=False,
+        server_default=func.now(),
+        onupdate=func.now(),
+    )
@@ -1,2 +1,3 @@
 from .lead import LeadCreate, LeadUpdate
 from .lead_item import LeadItemCreate, LeadItemUpdate
+from .amo_product import AmoProductCreate, AmoProductUpdate
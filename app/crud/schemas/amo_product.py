@@ -0,0 +1,14 @@
+from pydantic import BaseModel
+
+
+class AmoProductCreate(BaseModel):
+    amo_id: int
+    nid: str
+    notion_id: str | None
+    data: dict
+    data_hash: str
+    payload_hash: str | None = None
+
+
+class AmoProductUpdate(AmoProductCreate):
+    pass
@@ -0,0 +1,181 @@
+import threading
+import time
+
+from app.core import settings
+from app.core.config import red
+from app.core.db import SessionLocal
+from app.crud import lead as lead_crud
+from app.repository.tgbot import Alert
+from app.schemas.lead import parse_lead_update
+from app.services import AMOService
+
+
+class LeadDebouncer:
+    """
+    Склейка хуков amoCRM по сделке.
+
+    События сделки копятся HOOKS_DEBOUNCE_SECONDS с первого хука: от обновлений сделки
+    остаётся последнее, изменения товаров сводятся к флагу и множеству удалённых id.
+    По истечении окна выполняется одна сверка сделки вместо обработки каждого хука.
+
+    Сделка забирается из очереди не удалением, а переносом на HOOKS_DEBOUNCE_LEASE_SECONDS
+    вперёд: если процесс упал во время сверки, её подхватит другой поток. Состояние
+    удаляется только после успешной сверки и только если с момента чтения не пришло новых
+    хуков (счётчик version), иначе сделка сверяется ещё раз. Ошибка сверки повторяется
+    с нарастающей задержкой, после HOOKS_MAX_ATTEMPTS попыток сделка уходит в dead-letter.
+    """
+    queue_key = 'amo-lead-debounce'
+
+    _pop_script = red.register_script('''
+        local due = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, 1)
+        if #due == 0 then
+            return false
+        end
+        redis.call('ZADD', KEYS[1], ARGV[2], due[1])
+        return due[1]
+    ''')
+    _done_script = red.register_script('''
+        if (redis.call('HGET', KEYS[2], 'version') or '') == ARGV[2] then
+            redis.call('DEL', KEYS[2], KEYS[3])
+            redis.call('ZREM', KEYS[1], ARGV[1])
+            return 1
+        end
+        redis.call('HDEL', KEYS[2], 'attempts')
+        redis.call('ZADD', KEYS[1], ARGV[3], ARGV[1])
+        return 0
+    ''')
+
+    @classmethod
+    def _state_key(cls, lead_id: int | bytes) -> str:
+        return f'{cls.queue_key}-{int(lead_id)}'
+
+    @classmethod
+    def _deleted_key(cls, lead_id: int | bytes) -> str:
+        return f'{cls.queue_key}-deleted-{int(lead_id)}'
+
+    @classmethod
+    def _busy_key(cls, lead_id: int | bytes) -> str:
+        return f'{cls.queue_key}-busy-{int(lead_id)}'
+
+    @classmethod
+    def push(cls,
+             lead_id: int,
+             lead_body: bytes | None = None,
+             items: bool = False,
+             force: bool = False,
+             deleted: list[int] | None = None):
+        state = {}
+        if lead_body is not None:
+            state['lead'] = lead_body
+        if items:
+            state['items'] = '1'
+        if force:
+            state['force'] = '1'
+        # состояние и постановка в очередь одной транзакцией, чтобы сверка не увидела сделку без данных
+        with red.pipeline() as pipe:
+            if state:
+                pipe.hset(cls._state_key(lead_id), mapping=state)
+            pipe.hincrby(cls._state_key(lead_id), 'version', 1)
+            if deleted:
+                pipe.sadd(cls._deleted_key(lead_id), *deleted)
+            pipe.zadd(cls.queue_key, {lead_id: time.time() + settings.HOOKS_DEBOUNCE_SECONDS}, nx=True)
+            pipe.execute()
+
+    @classmethod
+    def pop_due(cls) -> int | None:
+        now = time.time()
+        lead_id = cls._pop_script(keys=[cls.queue_key], args=[now, now + settings.HOOKS_DEBOUNCE_LEASE_SECONDS])
+        return int(lead_id) if lead_id is not None else None
+
+    @classmethod
+    def flush(cls, lead_id: int):
+        # сверка сделки ещё идёт в другом потоке - откладываем на следующее окно
+        if not red.set(cls._busy_key(lead_id), '1', nx=True, ex=settings.HOOKS_DEBOUNCE_LEASE_SECONDS):
+            red.zadd(cls.queue_key, {lead_id: time.time() + settings.HOOKS_DEBOUNCE_SECONDS})
+            return
+        try:
+            with red.pipeline() as pipe:
+                pipe.hgetall(cls._state_key(lead_id))
+                pipe.smembers(cls._deleted_key(lead_id))
+                state, deleted = pipe.execute()
+            try:
+                cls.reconcile(lead_id, state, [int(item_id) for item_id in deleted])
+            except Exception as ex:
+                if not cls.retry_or_dead_letter(lead_id, state, deleted, ex):
+                    return
+            cls._done_script(
+                keys=[cls.queue_key, cls._state_key(lead_id), cls._deleted_key(lead_id)],
+                args=[lead_id, state.get(b'version', b''), time.time() + settings.HOOKS_DEBOUNCE_SECONDS],
+            )
+        finally:
+            red.delete(cls._busy_key(lead_id))
+
+    @classmethod
+    def retry_or_dead_letter(cls, lead_id: int, state: dict[bytes, bytes], deleted: set[bytes], ex: Exception) -> bool:
+        """
+        Откладывает сверку на повтор и возвращает False. После HOOKS_MAX_ATTEMPTS попыток
+        переносит сделку в dead-letter и возвращает True - состояние можно удалять.
+        """
+        attempts = red.hincrby(cls._state_key(lead_id), 'attempts', 1)
+        if attempts < settings.HOOKS_MAX_ATTEMPTS:
+            red.zadd(cls.queue_key, {lead_id: time.time() + settings.HOOKS_RETRY_DELAY * attempts})
+            return False
+        red.xadd('amo-hooks-dead', {
+            'type': 'lead-debounce',
+            'lead_id': lead_id,
+            'deleted': ','.join(item_id.decode() for item_id in deleted),
+            **{k.decode(): v for k, v in state.items()},
+            'error': str(ex),
+        })
+        try:
+            Alert.critical(f'⛔️Ошибка при сверке сделки\n'
+                           f'[Сделка:](https://ceh.amocrm.ru/leads/detail/{lead_id})`'
+                           f'\n\n{ex}')
+        except Exception as alert_ex:
+            print('Debounce alert error:', alert_ex)
+        return True
+
+    @classmethod
+    def reconcile(cls, lead_id: int, state: dict[bytes, bytes], deleted: list[int]):
+        with SessionLocal() as db:
+            service = AMOService(db)
+            # все записи сверки - одной короткой транзакцией в конце, после запросов в notion и amoCRM
+            with service.deferred_writes():
+                if b'lead' in state:
+                    lead = parse_lead_update(state[b'lead'])
+                    # окно склейки уже выждано, ждать обновления количества не нужно
+                    if lead is not None and service.process_lead_update_hook(lead, wait_quantity=False):
+                        # новая сделка: товары только что загружены целиком, повторная сверка не нужна
+                        if deleted:
+                            service.process_dt_products_update([], [], deleted)
+                        return
+                if b'items' not in state and not deleted:
+                    return
+                # товары сверяем только у сделок, которые ведём
+                if lead_crud.get_by_amo_id(db, lead_id) is None:
+                    return
+                service.sync_lead_items(
+                    lead_id,
+                    deleted=deleted,
+                    check_hash=b'force' not in state,
+                    wait_quantity=False,
+                )
+
+
+class DebounceFlusher(threading.Thread):
+    """Забирает сделки, у которых истекло окно склейки, и сверяет их."""
+
+    def __init__(self, n: int):
+        super().__init__(name=f'debounce-flusher-{n}', daemon=True)
+
+    def run(self):
+        while True:
+            try:
+                lead_id = LeadDebouncer.pop_due()
+                if lead_id is None:
+                    time.sleep(.5)
+                    continue
+                LeadDebouncer.flush(lead_id)
+            except Exception as ex:
+                print('Debounce flusher error:', ex)
+                time.sleep(1)
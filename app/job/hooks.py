@@ -0,0 +1,246 @@
+import asyncio
+import socket
+import threading
+import time
+
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from redis.exceptions import ResponseError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core import settings
+from app.core.config import red, ared
+from app.core.db import SessionLocal
+from app.core.logger import get_logger
+from app.crud import lead_item as lead_item_crud, lead_item_async as lead_item_async_crud
+from app.job.debounce import LeadDebouncer
+from app.repository.tgbot import Alert
+from app.schemas import parse_dt_product_update
+from app.schemas.lead import parse_lead_update
+
+log = get_logger()
+
+# разбор тела хука - чистый CPU. Несколько таких потоков по очереди забирают GIL у event loop,
+# и он стоит, пока они не закончат, поэтому тела разбираются по одному в отдельном потоке
+_parse_pool = ThreadPoolExecutor(1, thread_name_prefix='hook-parse')
+
+
+async def _parse(func, body: bytes):
+    return await asyncio.get_running_loop().run_in_executor(_parse_pool, func, body)
+
+
+class HookQueue:
+    """
+    Очередь хуков amoCRM на redis streams.
+
+    Хуки раскладываются по HOOKS_PARTITIONS стримам по id сделки, каждый стрим
+    читает ровно один HookWorker, поэтому хуки одной сделки обрабатываются по порядку.
+    """
+    stream_prefix = 'amo-hooks'
+    dead_stream = 'amo-hooks-dead'
+    group = 'amo-hooks-workers'
+
+    lead_update = 'lead-update'
+    item_update = 'item-update'
+    sync_lead_items = 'sync-lead-items'
+
+    @classmethod
+    def stream(cls, partition: int) -> str:
+        return f'{cls.stream_prefix}-{partition}'
+
+    @classmethod
+    def push(cls, type: str, body: bytes, key: int) -> str:
+        return red.xadd(
+            cls.stream(key % settings.HOOKS_PARTITIONS),
+            {'type': type, 'body': body},
+            maxlen=settings.HOOKS_STREAM_MAXLEN,
+            approximate=True,
+        )
+
+    @classmethod
+    async def apush(cls, type: str, body: bytes, key: int) -> str:
+        """push для async-хендлеров, не блокирует event loop."""
+        return await ared.xadd(
+            cls.stream(key % settings.HOOKS_PARTITIONS),
+            {'type': type, 'body': body},
+            maxlen=settings.HOOKS_STREAM_MAXLEN,
+            approximate=True,
+        )
+
+    @staticmethod
+    async def lead_key(body: bytes) -> int | None:
+        lead = await _parse(parse_lead_update, body)
+        return lead.id if lead is not None else None
+
+    @staticmethod
+    async def items_key(body: bytes, db: AsyncSession) -> int | None:
+        added, updated, deleted = await _parse(parse_dt_product_update, body)
+        for item in added + updated:
+            if item.lead_id() != 0:
+                return item.lead_id()
+        if not deleted:
+            return None
+        # у удалённых товаров сделки в хуке нет, берём её из бд, чтобы хук встал в стрим сделки
+        items = await lead_item_async_crud.get_by_item_ids(db, deleted)
+        return items[0].lead_id if items else deleted[0]
+
+    @classmethod
+    def handle(cls, type: str, body: bytes):
+        # обработка откладывается в LeadDebouncer, который склеивает хуки одной сделки
+        if type == cls.lead_update:
+            lead = parse_lead_update(body)
+            if lead is not None:
+                LeadDebouncer.push(lead.id, lead_body=body)
+        elif type == cls.item_update:
+            added, updated, deleted = parse_dt_product_update(body)
+            leads_ids = {item.lead_id() for item in added + updated} - {0}
+            deleted_by_lead = defaultdict(list)
+            if deleted:
+                with SessionLocal() as db:
+                    for item in lead_item_crud.get_by_item_ids(db, deleted):
+                        deleted_by_lead[item.lead_id].append(item.item_id)
+            for lead_id in leads_ids | deleted_by_lead.keys():
+                LeadDebouncer.push(
+                    lead_id,
+                    items=lead_id in leads_ids,
+                    deleted=deleted_by_lead.get(lead_id),
+                )
+        elif type == cls.sync_lead_items:
+            LeadDebouncer.push(int(body), items=True, force=True)
+        else:
+            raise ValueError(f'Unknown hook type: {type}')
+
+
+class HookWorker(threading.Thread):
+    """Обрабатывает один стрим очереди: ретраи на месте, после HOOKS_MAX_ATTEMPTS - в dead-letter."""
+
+    def __init__(self, partition: int):
+        super().__init__(name=f'hook-worker-{partition}', daemon=True)
+        self.stream = HookQueue.stream(partition)
+        self.consumer = f'{socket.gethostname()}-{partition}'
+
+    def run(self):
+        self.setup()
+        # сначала дочитываем свои неподтверждённые сообщения, потом новые
+        last_id = '0'
+        next_claim = time.monotonic() + settings.HOOKS_CLAIM_IDLE_MS / 1000
+        while True:
+            try:
+                resp = red.xreadgroup(
+                    HookQueue.group,
+                    self.consumer,
+                    {self.stream: last_id},
+                    count=10,
+                    block=5000,
+                )
+            except Exception as ex:
+                log.warning({'type': 'hook-worker', 'stream': self.stream, 'error': str(ex)})
+                time.sleep(1)
+                continue
+            entries = resp[0][1] if resp else []
+            if last_id == '0' and not entries:
+                last_id = '>'
+                continue
+            # потребитель упавшего или пересозданного контейнера больше не придёт за своими
+            # сообщениями: забираем их на каждом пустом чтении и не реже раза в HOOKS_CLAIM_IDLE_MS
+            if not entries or time.monotonic() >= next_claim:
+                next_claim = time.monotonic() + settings.HOOKS_CLAIM_IDLE_MS / 1000
+                if self.try_claim_stale():
+                    last_id = '0'
+            for msg_id, fields in entries:
+                # пустые поля - сообщение уже вытеснено из стрима
+                done = self.process(msg_id, fields) if fields else True
+                if not (done and self.ack(msg_id)):
+                    # сообщение осталось в pending - перечитаем его со следующего круга
+                    last_id = '0'
+                    time.sleep(1)
+                    break
+
+    def setup(self):
+        while True:
+            try:
+                try:
+                    red.xgroup_create(self.stream, HookQueue.group, id='0', mkstream=True)
+                except ResponseError as ex:
+                    if 'BUSYGROUP' not in str(ex):
+                        raise
+                self.claim_stale()
+                return
+            except Exception as ex:
+                log.warning({'type': 'hook-worker', 'stream': self.stream, 'error': str(ex)})
+                time.sleep(1)
+
+    def ack(self, msg_id: bytes) -> bool:
+        try:
+            red.xack(self.stream, HookQueue.group, msg_id)
+            return True
+        except Exception as ex:
+            log.warning({'type': 'hook-worker', 'stream': self.stream, 'id': msg_id, 'error': str(ex)})
+            return False
+
+    def claim_stale(self) -> bool:
+        """
+        Забирает сообщения, зависшие у потребителей, которые больше не запущены.
+        Возвращает True, если что-то забрано: оно уже в pending этого потребителя.
+        """
+        claimed = False
+        start_id = '0-0'
+        while True:
+            start_id, messages, *_ = red.xautoclaim(
+                self.stream,
+                HookQueue.group,
+                self.consumer,
+                min_idle_time=settings.HOOKS_CLAIM_IDLE_MS,
+                start_id=start_id,
+            )
+            claimed = claimed or bool(messages)
+            if start_id in (b'0-0', '0-0'):
+                return claimed
+
+    def try_claim_stale(self) -> bool:
+        try:
+            return self.claim_stale()
+        except Exception as ex:
+            log.warning({'type': 'hook-worker', 'stream': self.stream, 'claim': str(ex)})
+            return False
+
+    def process(self, msg_id: bytes, fields: dict[bytes, bytes]) -> bool:
+        """
+        Обрабатывает сообщение с ретраями. Возвращает True, если сообщение можно подтвердить:
+        оно обработано или перенесено в dead-letter. Если не удалось даже это, сообщение
+        остаётся неподтверждённым и будет прочитано повторно.
+        """
+        type = fields.get(b'type', b'').decode()
+        body = fields.get(b'body', b'')
+        attempts = 0
+        while True:
+            try:
+                HookQueue.handle(type, body)
+                return True
+            except Exception as ex:
+                attempts += 1
+                error = ex
+                if attempts < settings.HOOKS_MAX_ATTEMPTS:
+                    time.sleep(settings.HOOKS_RETRY_DELAY * attempts)
+                    continue
+                break
+
+        try:
+            red.xadd(HookQueue.dead_stream, {
+                'type': type,
+                'body': body,
+                'stream': self.stream,
+                'id': msg_id,
+                'error': str(error),
+            })
+        except Exception as ex:
+            log.warning({'type': 'hook-worker', 'stream': self.stream, 'id': msg_id, 'dead-letter': str(ex)})
+            return False
+
+        # сообщение уже в dead-letter, сбой алерта не должен оставлять его в pending
+        try:
+            Alert.critical(f'⛔️Ошибка при обработке хука amoCRM `{type}`, перенесён в {HookQueue.dead_stream}:\n\n{error}')
+        except Exception as ex:
+            log.warning({'type': 'hook-worker', 'stream': self.stream, 'id': msg_id, 'alert': str(ex)})
+        return True
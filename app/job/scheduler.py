@@ -0,0 +1,146 @@
+import multiprocessing
+import random
+import time
+
+from typing import Callable
+
+from app.core import settings
+from app.core.config import red
+from app.core.logger import get_logger
+from app.repository.tgbot import Alert
+from app.utils.lock import LeaseLock
+
+log = get_logger()
+
+
+class Job:
+    """
+    Периодическая задача планировщика.
+
+    Запуски идут по сетке `interval` от старта процесса со случайной задержкой до `jitter`,
+    чтобы реплики не били в Notion и amoCRM одновременно. Если запуск не уложился в интервал,
+    пропущенные тики обрабатываются по `missed`: skip - ждём следующий тик сетки,
+    run - сразу запускаемся один раз. Задача выполняется под LeaseLock, поэтому на
+    нескольких узлах одновременно работает только один экземпляр.
+    Время каждого запуска пишется в лог и в redis-хеш `scheduler-stats-{name}`.
+
+    Внеочередной запуск заказывается через `trigger()` из любого процесса (например, из API):
+    задача ждёт тика на redis-списке `scheduler-trigger-{name}` и просыпается по запросу.
+    Задача с interval=None запускается только по запросу.
+    """
+    # между ожиданиями на списке проверяем соединение с redis
+    trigger_poll = 5
+
+    def __init__(self,
+                 name: str,
+                 func: Callable[[int], None],
+                 lock: Callable[[], LeaseLock],
+                 interval: float | None):
+        self.name = name
+        self.func = func
+        self.lock = lock
+        self.interval = interval
+        self.stats_key = f'scheduler-stats-{name}'
+        self.trigger_key = f'scheduler-trigger-{name}'
+
+    def trigger(self):
+        """Заказывает внеочередной запуск. Запрос, не забранный за SCHEDULER_TRIGGER_TTL, сгорает."""
+        with red.pipeline() as pipe:
+            pipe.rpush(self.trigger_key, 1)
+            pipe.expire(self.trigger_key, int(settings.SCHEDULER_TRIGGER_TTL))
+            pipe.execute()
+
+    def wait_trigger(self, timeout: float | None) -> bool:
+        """Ждёт запроса на запуск до timeout секунд, None - без ограничения. True, если запрос пришёл."""
+        deadline = None if timeout is None else time.time() + timeout
+        while True:
+            chunk = self.trigger_poll if deadline is None else min(self.trigger_poll, deadline - time.time())
+            if chunk <= 0:
+                return False
+            try:
+                if red.blpop([self.trigger_key], timeout=chunk) is not None:
+                    # несколько запросов подряд склеиваются в один запуск
+                    red.delete(self.trigger_key)
+                    return True
+            except Exception as ex:
+                log.warning({'type': 'scheduler', 'job': self.name, 'trigger': str(ex)})
+                time.sleep(min(1, chunk))
+
+    def next_run(self, scheduled: float, now: float) -> float:
+        scheduled += self.interval
+        if scheduled > now:
+            return scheduled
+        if settings.SCHEDULER_MISSED_RUNS == settings.MissedRuns.run:
+            return now
+        missed = int((now - scheduled) // self.interval) + 1
+        return scheduled + missed * self.interval
+
+    def run_once(self, scheduled: float):
+        lock = self.lock()
+        if lock.acquire() is None:
+            log.warning({'type': 'scheduler', 'job': self.name, 'skipped': 'locked'})
+            return
+        started = time.time()
+        failed = False
+        try:
+            lock.run(self.func, lock.token)
+        except Exception as ex:
+            failed = True
+            Alert.critical(f'`❌ Ошибка задачи планировщика {self.name}:\n\n{ex}`')
+        duration = time.time() - started
+        log.warning({
+            'type': 'scheduler',
+            'job': self.name,
+            'duration': round(duration, 3),
+            'lag': round(started - scheduled, 3),
+            'failed': failed,
+        })
+        with red.pipeline() as pipe:
+            pipe.hset(self.stats_key, mapping={
+                'last_started': started,
+                'last_duration': duration,
+            })
+            pipe.hincrby(self.stats_key, 'runs', 1)
+            pipe.hincrbyfloat(self.stats_key, 'total_duration', duration)
+            if failed:
+                pipe.hincrby(self.stats_key, 'failures', 1)
+            pipe.execute()
+
+    def loop(self):
+        if self.interval is None:
+            while True:
+                if self.wait_trigger(None):
+                    self.run_once(time.time())
+        scheduled = time.time() + self.interval
+        while True:
+            delay = scheduled - time.time() + random.uniform(0, settings.SCHEDULER_JITTER)
+            if delay > 0 and self.wait_trigger(delay):
+                # внеочередной запуск заменяет ближайший тик сетки
+                self.run_once(time.time())
+            else:
+                self.run_once(scheduled)
+            scheduled = self.next_run(scheduled, time.time())
+
+
+class Scheduler:
+    """Запускает каждую задачу в отдельном процессе и перезапускает упавшие процессы."""
+
+    def __init__(self, jobs: list[Job]):
+        self.jobs = jobs
+        self.processes: dict[str, multiprocessing.Process] = {}
+
+    def start(self, job: Job):
+        process = multiprocessing.Process(target=job.loop, name=f'scheduler-{job.name}', daemon=True)
+        process.start()
+        self.processes[job.name] = process
+
+    def run(self):
+        for job in self.jobs:
+            self.start(job)
+        while True:
+            time.sleep(settings.SCHEDULER_JITTER + 1)
+            for job in self.jobs:
+                process = self.processes[job.name]
+                if not process.is_alive():
+                    Alert.critical(f'`❌ Процесс задачи {job.name} завершился с кодом {process.exitcode}, перезапуск`')
+                    self.start(job)
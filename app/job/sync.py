@@ -1,15 +1,53 @@
+from app.core import settings
+from app.core.config import red
 from app.core.logger import get_logger
+from app.job.scheduler import Job
 from app.repository.tgbot import Alert
-from app.services import NotionService
+from app.services import NotionService, CatalogService
+from app.utils.lock import LeaseLock, LeaseLost
 
 log = get_logger()
 
 
-def sync_notion_amo():
+def sync_lock() -> LeaseLock:
+    return LeaseLock(red, 'sync-running', settings.SYNC_LEASE_SECONDS)
+
+
+def sync_leads_lock() -> LeaseLock:
+    return LeaseLock(red, 'sync-leads-running', settings.SYNC_LEASE_SECONDS)
+
+
+def sync_mirror_lock() -> LeaseLock:
+    return LeaseLock(red, 'sync-mirror-running', settings.SYNC_LEASE_SECONDS)
+
+
+def sync_notion_amo(fence: int | None = None):
     log.warn('start job sync_notion_amo')
-    NotionService.sync_with_amo()
+    NotionService.sync_with_amo(fence=fence)
 
 
-def sync_notion_leads():
+def sync_notion_amo_full(fence: int | None = None):
+    log.warn('start job sync_notion_amo_full')
+    NotionService.sync_with_amo(True, fence=fence)
+
+
+def sync_notion_leads(fence: int | None = None):
     log.warn('start job sync_notion_leads')
-    NotionService.sync_leads()
+    NotionService.sync_leads(fence=fence)
+
+
+def refresh_amo_mirror(fence: int | None = None):
+    log.warn('start job refresh_amo_mirror')
+    try:
+        CatalogService.refresh()
+    except LeaseLost as ex:
+        log.warning(f'refresh_amo_mirror aborted: {ex}')
+    except Exception as ex:
+        Alert.critical(f'`❌ Ошибка обновления зеркала каталога amoCRM:\n\n{ex}`')
+
+
+# задачи планировщика; API заказывает их внеочередной запуск через trigger(), а не выполняет сам
+catalog_job = Job('sync-catalog', sync_notion_amo, sync_lock, settings.SYNC_CATALOG_INTERVAL)
+catalog_full_job = Job('sync-catalog-full', sync_notion_amo_full, sync_lock, None)
+leads_job = Job('sync-leads', sync_notion_leads, sync_leads_lock, settings.SYNC_LEADS_INTERVAL)
+mirror_job = Job('sync-mirror', refresh_amo_mirror, sync_mirror_lock, settings.AMOCRM_MIRROR_REFRESH_SECONDS)
@@ -1,15 +1,18 @@
+import asyncio
+
 import uvicorn
 
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi_utilities import repeat_every
 
 from app.core import settings
-from app.core.config import red
+from app.core.logger import get_logger
 from app.core.middleware import catch_exceptions_middleware
-from app.job.sync import sync_notion_amo, sync_notion_leads
 from app.api.v1.router import api_router as v1_router
 from app.repository.tgbot import Alert
+from app.utils.aio import watch_loop_lag
+
+log = get_logger()
 
 app = FastAPI(
     title=settings.PROJECT_NAME,
@@ -33,23 +36,16 @@ if settings.ENVIRONMENT != settings.Environment.local.value:
 
 
 @app.on_event('startup')
-@repeat_every(seconds=10, wait_first=True)
-def sync():
-    if red.get('sync-running') is not None:
-        print('sync already running')
-        return
-    red.set('sync-running', '1')
-    sync_notion_amo()
+async def start_loop_watchdog():
+    def on_lag(lag: float):
+        log.warning({'type': 'loop-lag', 'lag': round(lag, 3)})
 
-
-@app.on_event('startup')
-@repeat_every(seconds=10, wait_first=True)
-def sync_leads():
-    if red.get('sync-leads-running') is not None:
-        print('sync leads already running')
-        return
-    red.set('sync-leads-running', '1')
-    sync_notion_leads()
+    # ссылка на задачу, иначе сборщик мусора может её снять
+    app.state.loop_watchdog = asyncio.create_task(watch_loop_lag(
+        settings.LOOP_LAG_INTERVAL,
+        settings.LOOP_LAG_THRESHOLD,
+        on_lag,
+    ))
 
 
 @app.on_event('shutdown')
@@ -59,6 +55,4 @@ def shutdown():
 
 if __name__ == "__main__":
     Alert.critical('`🟢 Сервер запущен.`')
-    red.delete('sync-running')
-    red.delete('sync-leads-running')
     uvicorn.run("app.main:app", host='0.0.0.0', port=8000)
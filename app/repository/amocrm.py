@@ -1,47 +1,75 @@
-import time
-
 import requests
 
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from itertools import islice
-from time import sleep
+
+from errors import ExternalIntegrationError
 
 from app.core import settings
+from app.core.config import red
 from app.schemas import Item, AMOProduct, AMODTProduct
 from app.schemas.lead import LeadUpdate
+from app.utils.http import make_session
+from app.utils.lock import ensure_lease
+from app.utils.rate_limit import TokenBucket
 
 
 class AmoRepo:
+    base_url = f'https://{settings.AMOCRM_SUBDOMAIN}.amocrm.ru'
+    session = make_session(
+        settings.AMOCRM_POOL_SIZE,
+        {'Content-Type': 'application/json'},
+    )
+    page_limit = 250
+    catalog_pages_key = 'amo-catalog-pages'
+    limiter = TokenBucket(
+        red,
+        'amo-rate-limit',
+        rate=settings.AMOCRM_RATE_LIMIT,
+        burst=settings.AMOCRM_RATE_BURST,
+    )
+
+    @classmethod
+    def _request(cls, method: str, url: str, **kwargs) -> requests.Response:
+        kwargs.setdefault('timeout', (settings.AMOCRM_CONNECT_TIMEOUT, settings.AMOCRM_READ_TIMEOUT))
+        cls.limiter.acquire()
+        return cls.session.request(
+            method,
+            cls.base_url + url,
+            headers={'Authorization': 'Bearer ' + settings.AMOCRM_ACCESS_TOKEN},
+            **kwargs,
+        )
 
     @classmethod
     def get_product_by_nid(cls, nid: str) -> Item | None:
-        time.sleep(.2)
         url = '/api/v4/catalogs/12367/elements'
-        access_token = "Bearer " + settings.AMOCRM_ACCESS_TOKEN
-        headers = {
-            "Authorization": access_token,
-            "Content-Type": "application/json"
-        }
-        params = {
-            'query': nid,
-        }
+        page = 1
 
-        response = requests.get(
-            "https://{}.amocrm.ru{}".format(settings.AMOCRM_SUBDOMAIN, url),
-            headers=headers,
-            params=params,
-        )
+        while True:
+            params = {
+                'query': nid,
+                'page': page,
+                'limit': cls.page_limit,
+            }
 
-        if response.status_code == 204:
-            return None
+            response = cls._request(
+                'GET',
+                url,
+                params=params,
+            )
 
-        # TODO добавить считывание пагинации
-        elements = response.json().get('_embedded', {}).get('elements', [])
-        for elem in elements:
-            item = AMOProduct(**elem).to_notion_item()
-            if item.nid == nid:
-                return item
+            if response.status_code == 204:
+                return None
 
-        return None
+            elements = response.json().get('_embedded', {}).get('elements', [])
+            for elem in elements:
+                item = AMOProduct(**elem).to_notion_item()
+                if item.nid == nid:
+                    return item
+
+            if len(elements) < cls.page_limit:
+                return None
+            page += 1
 
     @classmethod
     def chunks(cls, iterable, size):
@@ -50,37 +78,37 @@ class AmoRepo:
             yield [first] + list(islice(iterator, size - 1))
 
     @classmethod
-    def add_products(cls, items: list[Item]):
+    def add_products(cls, items: list[Item]) -> list[Item]:
+        """Создаёт товары в каталоге и возвращает созданные с проставленным amo_id."""
         if len(items) == 0:
-            return
+            return []
         url = '/api/v4/catalogs/12367/elements'
-        access_token = "Bearer " + settings.AMOCRM_ACCESS_TOKEN
-        headers = {
-            "Authorization": access_token,
-            "Content-Type": "application/json"
-        }
         products = [
             AMOProduct.from_notion_item(item).dict() for item in items
         ]
         for p in products:
             p.pop('id', None)
-        for i, batch in enumerate(cls.chunks(products, 50)):
+        created = []
+        for i, batch in enumerate(cls.chunks(zip(items, products), 50)):
             n = 1
             while n != 6:
-                sleep(0.2)
-                response = requests.post(
-                    "https://{}.amocrm.ru{}".format(settings.AMOCRM_SUBDOMAIN, url),
-                    headers=headers,
-                    json=batch,
+                response = cls._request(
+                    'POST',
+                    url,
+                    json=[product for _, product in batch],
                 )
 
                 if response.status_code == 200:
                     print(f"Batch {i + 1} added successfully!")
+                    elements = response.json().get('_embedded', {}).get('elements', [])
+                    for (item, _), elem in zip(batch, elements):
+                        item.amo_id = str(elem['id'])
+                        created.append(item)
                     break
                 else:
-                    sleep(1)
                     print(f"Failed to add batch {i + 1}. Retrying...", n)
                     n += 1
+        return created
 
     @staticmethod
     def chunk_list(data, chunk_size):
@@ -89,15 +117,11 @@ class AmoRepo:
             yield data[i:i + chunk_size]
 
     @classmethod
-    def patch_items(cls, items: list[Item]):
+    def patch_items(cls, items: list[Item]) -> list[Item]:
+        """Обновляет товары в каталоге и возвращает успешно обновлённые."""
         if len(items) == 0:
-            return
+            return []
         url = f'/api/v4/catalogs/12367/elements'
-        access_token = "Bearer " + settings.AMOCRM_ACCESS_TOKEN
-        headers = {
-            "Authorization": access_token,
-            "Content-Type": "application/json"
-        }
         data = [
             {
                 "id": int(item.amo_id),
@@ -106,69 +130,86 @@ class AmoRepo:
             }
             for item in items
         ]
-        for i, batch in enumerate(cls.chunk_list(data, 50)):
-            response = requests.patch(
-                "https://{}.amocrm.ru{}".format(settings.AMOCRM_SUBDOMAIN, url),
-                headers=headers,
+        patched = []
+        for i, (items_batch, batch) in enumerate(zip(cls.chunk_list(items, 50), cls.chunk_list(data, 50))):
+            response = cls._request(
+                'PATCH',
+                url,
                 json=batch
             )
             if response.status_code != 200:
                 print(f"Failed to update amo batch: {response.status_code} - {response.text}")
             else:
                 print(f"Batch {i} updated successfully")
+                patched.extend(items_batch)
+        return patched
 
     @classmethod
-    def get_all_products(cls) -> list[Item]:
-        time.sleep(.2)
+    def get_products_page(cls, page: int) -> list[Item]:
         url = '/api/v4/catalogs/12367/elements'
-        access_token = "Bearer " + settings.AMOCRM_ACCESS_TOKEN
-        headers = {
-            "Authorization": access_token,
-            "Content-Type": "application/json"
+        params = {
+            'page': page,
+            'limit': cls.page_limit,
         }
 
-        page = 1
-        items = []
-
-        while True:
-            params = {
-                'page': page,
-                'limit': 250,
-            }
+        response = cls._request(
+            'GET',
+            url,
+            params=params,
+        )
 
-            response = requests.get(
-                "https://{}.amocrm.ru{}".format(settings.AMOCRM_SUBDOMAIN, url),
-                headers=headers,
-                params=params,
+        if response.status_code == 204:
+            return []
+        if response.status_code != 200:
+            raise ExternalIntegrationError(
+                f'Failed to fetch products: {response.status_code}',
+                params,
+                response.text,
             )
 
-            if response.status_code != 200:
-                print(f"Failed to fetch products: {response.status_code} - {response.text}")
-                break
-
-            elements = response.json().get('_embedded', {}).get('elements', [])
-            if not elements:
-                break
-
-            for elem in elements:
-                item = AMOProduct(**elem).to_notion_item()
-                items.append(item)
+        elements = response.json().get('_embedded', {}).get('elements', [])
+        return [AMOProduct(**elem).to_notion_item() for elem in elements]
 
-            print(f'Loaded products from amo: {len(items)}')
+    @classmethod
+    def get_all_products(cls) -> list[Item]:
+        # количество страниц берём из прошлого обхода, чтобы сразу запросить их все параллельно,
+        # дальше идём окнами по AMOCRM_FETCH_CONCURRENCY страниц до первой неполной
+        concurrency = settings.AMOCRM_FETCH_CONCURRENCY
+        pages_hint = int(red.get(cls.catalog_pages_key) or 0)
+        pages: dict[int, list[Item]] = {}
+        stop_page = None  # первая страница, которую уже не нужно учитывать
+        next_page = 1
+        window = max(pages_hint + 1, concurrency)
+
+        with ThreadPoolExecutor(concurrency) as pool:
+            while stop_page is None:
+                ensure_lease()
+                futures = {
+                    pool.submit(cls.get_products_page, page): page
+                    for page in range(next_page, next_page + window)
+                }
+                next_page += window
+                window = concurrency
+                for future in as_completed(futures):
+                    page = futures[future]
+                    items = future.result()
+                    if items:
+                        pages[page] = items
+                        print(f'Loaded products from amo: page {page}, {len(items)}')
+                    if len(items) < cls.page_limit:
+                        last = page + 1 if items else page
+                        stop_page = min(stop_page or last, last)
 
-            page += 1
-            time.sleep(0.2)
+        items = []
+        for page in range(1, stop_page):
+            items.extend(pages.get(page, []))
+        red.set(cls.catalog_pages_key, len(pages))
+        print(f'Loaded products from amo: {len(items)}')
         return items
 
     @classmethod
     def attach_item_to_lead(cls, lead_id: int, item_id: int, quantity: int = None):
-        time.sleep(.2)
         url = f'/api/v4/leads/{lead_id}/link'
-        access_token = "Bearer " + settings.AMOCRM_ACCESS_TOKEN
-        headers = {
-            "Authorization": access_token,
-            "Content-Type": "application/json"
-        }
         data = [
             {
                 "to_entity_id": item_id,
@@ -180,9 +221,9 @@ class AmoRepo:
         ]
         if quantity is not None:
             data[0]['metadata']['quantity'] = float(quantity)
-        response = requests.post(
-            "https://{}.amocrm.ru{}".format(settings.AMOCRM_SUBDOMAIN, url),
-            headers=headers,
+        response = cls._request(
+            'POST',
+            url,
             json=data,
         )
         if response.status_code == 200:
@@ -192,19 +233,11 @@ class AmoRepo:
 
     @classmethod
     def get_lead_items_ids(cls, lead_id: int) -> (list[(int, int)], str, str):
-        time.sleep(.2)
         url = f'/api/v4/leads/{lead_id}'
-        access_token = "Bearer " + settings.AMOCRM_ACCESS_TOKEN
-        headers = {
-            "Authorization": access_token,
-            "Content-Type": "application/json"
-        }
         params = {
             'with': 'catalog_elements'
         }
-        response = requests.get("https://{}.amocrm.ru{}".format(
-            settings.AMOCRM_SUBDOMAIN, url,
-        ), headers=headers, params=params)
+        response = cls._request('GET', url, params=params)
         items = list()
         lead_id = ''
         lead_uid = ''
@@ -224,19 +257,12 @@ class AmoRepo:
 
     @classmethod
     def add_dt_product(cls, item: AMODTProduct) -> AMODTProduct | None:
-        time.sleep(.2)
         url = '/api/v4/catalogs/9035/elements'
-        access_token = "Bearer " + settings.AMOCRM_ACCESS_TOKEN
-        headers = {
-            "Authorization": access_token,
-            "Content-Type": "application/json"
-        }
         n = 1
         while n != 6:
-            sleep(0.2)
-            response = requests.post(
-                "https://{}.amocrm.ru{}".format(settings.AMOCRM_SUBDOMAIN, url),
-                headers=headers,
+            response = cls._request(
+                'POST',
+                url,
                 json=[item.model_dump()],
             )
             if response.status_code == 200:
@@ -244,23 +270,16 @@ class AmoRepo:
                 print(f"Item created successfully!")
                 return item
             else:
-                sleep(1)
                 print(f"Failed to create item", n)
                 n += 1
 
     @classmethod
     def update_lead_fields(cls, lead_id: int, fields: dict):
-        time.sleep(.2)
         url = f'/api/v4/leads/{lead_id}'
-        access_token = "Bearer " + settings.AMOCRM_ACCESS_TOKEN
-        headers = {
-            "Authorization": access_token,
-            "Content-Type": "application/json"
-        }
 
-        response = requests.patch(
-            "https://{}.amocrm.ru{}".format(settings.AMOCRM_SUBDOMAIN, url),
-            headers=headers,
+        response = cls._request(
+            'PATCH',
+            url,
             json=fields,
         )
         if response.status_code == 200:
@@ -269,43 +288,35 @@ class AmoRepo:
             print(f"Failed to update lead {lead_id}: {response.status_code} - {response.text}")
 
     @classmethod
-    def update_leads(cls, leads: list[LeadUpdate]):
+    def update_leads(cls, leads: list[LeadUpdate]) -> list[LeadUpdate]:
+        """Обновляет сделки и возвращает успешно обновлённые."""
         if len(leads) == 0:
-            return
-        time.sleep(.2)
+            return []
         url = f'/api/v4/leads'
-        access_token = "Bearer " + settings.AMOCRM_ACCESS_TOKEN
-        headers = {
-            "Authorization": access_token,
-            "Content-Type": "application/json"
-        }
         data = [
             lead.dict()
             for lead in leads
         ]
-        for i, batch in enumerate(cls.chunk_list(data, 50)):
-            response = requests.patch(
-                "https://{}.amocrm.ru{}".format(settings.AMOCRM_SUBDOMAIN, url),
-                headers=headers,
+        updated = []
+        for i, (leads_batch, batch) in enumerate(zip(cls.chunk_list(leads, 50), cls.chunk_list(data, 50))):
+            response = cls._request(
+                'PATCH',
+                url,
                 json=batch,
             )
             if response.status_code != 200:
                 print(f"Failed to update amo batch: {response.status_code} - {response.text}")
             else:
                 print(f"Batch {i} updated successfully")
+                updated.extend(leads_batch)
+        return updated
 
     @classmethod
     def update_lead_item_after_creation(cls, item_id, fields: dict):
-        time.sleep(.2)
         url = f'/api/v4/catalogs/9035/elements/{item_id}'
-        access_token = "Bearer " + settings.AMOCRM_ACCESS_TOKEN
-        headers = {
-            "Authorization": access_token,
-            "Content-Type": "application/json"
-        }
-        response = requests.patch(
-            "https://{}.amocrm.ru{}".format(settings.AMOCRM_SUBDOMAIN, url),
-            headers=headers,
+        response = cls._request(
+            'PATCH',
+            url,
             json=fields,
         )
         if response.status_code == 200:
@@ -315,51 +326,47 @@ class AmoRepo:
 
     @classmethod
     def get_lead_products(cls, ids: list[int]) -> list[AMODTProduct]:
-        time.sleep(.2)
         url = '/api/v4/catalogs/9035/elements'
-        access_token = "Bearer " + settings.AMOCRM_ACCESS_TOKEN
-        headers = {
-            "Authorization": access_token,
-            "Content-Type": "application/json"
-        }
 
-        result = []
+        elements = {}
 
-        for id in ids:
-            params = {
-                'id': id,
-            }
+        # запрашиваем товары пачками через filter[id][], не больше одной страницы за запрос
+        for batch in cls.chunk_list(list(dict.fromkeys(ids)), cls.page_limit):
+            params = [('filter[id][]', id) for id in batch]
+            params.append(('limit', cls.page_limit))
 
-            response = requests.get(
-                "https://{}.amocrm.ru{}".format(settings.AMOCRM_SUBDOMAIN, url),
-                headers=headers,
+            response = cls._request(
+                'GET',
+                url,
                 params=params,
             )
             if response.status_code == 204:
                 continue
-            data = response.json()
-            element = data.get('_embedded', {}).get('elements', [None])[0]
-            if element is not None:
-                result.append(AMODTProduct(**element))
-
-        return result
+            if response.status_code != 200:
+                print(f"Failed to fetch lead products: {response.status_code} - {response.text}")
+                continue
+            for element in response.json().get('_embedded', {}).get('elements', []):
+                elements[int(element['id'])] = element
+
+        # результат в порядке запрошенных id, отсутствующие пропускаем
+        return [
+            AMODTProduct(**elements[int(id)])
+            for id in ids
+            if int(id) in elements
+        ]
 
     @classmethod
-    def delete_from_catalog(cls, ids: list[int | str]):
-        time.sleep(.2)
+    def delete_from_catalog(cls, ids: list[int | str]) -> bool:
         url = '/api/v2/catalog_elements'
-        access_token = "Bearer " + settings.AMOCRM_ACCESS_TOKEN
-        headers = {
-            "Authorization": access_token,
-            "Content-Type": "application/json"
-        }
 
-        response = requests.post(
-            "https://{}.amocrm.ru{}".format(settings.AMOCRM_SUBDOMAIN, url),
-            headers=headers,
+        response = cls._request(
+            'POST',
+            url,
             json={'delete': ids},
         )
         if response.status_code == 200:
             print(f"Items {ids} deleted successfully!")
+            return True
         else:
             print(f"Failed to delete items {ids}: {response.status_code} - {response.text}")
+            return False
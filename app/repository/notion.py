@@ -1,67 +1,67 @@
-import os
-
 import pytz
 from notion_client import Client, APIResponseError
 from datetime import datetime, timedelta
-from dotenv import load_dotenv, find_dotenv, set_key
 
 from app.core import settings
+from app.core.config import red
 from app.crud.models.lead_item import LeadItem
 from app.schemas import AMODTProduct, NotionDTProduct
 from app.schemas.lead import Lead, LeadUpdate, NotionLead
 from app.schemas.notion import *
+from app.utils import TTLCache
+from app.utils.lock import ensure_lease
+from app.utils.watermark import Watermark
 
 
 class NotionRepo:
     items_db_id = 'f59c2429df1749979ea76509fcfcdb8c'
     lead_db_id = '5824aff3f4374a3787a37e5caa12d8e1'
     lead_items_db_id = '89e1c3694d174952901a94d1aba0d083'
-    updated_at_key = 'LAST_UPDATED_AT'
-    lead_updated_at_key = 'LAST_UPDATED_AT_LEADS'
     timezone = pytz.timezone('Asia/Almaty')
 
     client = Client(auth=settings.NOTION_SECRET)
+    # курсоры синхронизации, до переезда в redis хранились в .env под этими же именами
+    updated_at_watermark = Watermark(red, 'sync-watermark-items', seed_env='LAST_UPDATED_AT')
+    lead_updated_at_watermark = Watermark(red, 'sync-watermark-leads', seed_env='LAST_UPDATED_AT_LEADS')
+    items_cache = TTLCache(settings.NOTION_CACHE_SIZE, settings.NOTION_CACHE_TTL)
+
+    @classmethod
+    def _default_updated_at(cls) -> str:
+        updated_at = datetime.now(cls.timezone) - timedelta(days=365 * 3)
+        return updated_at.strftime('%Y-%m-%dT%H:%M:%S.%f%Z')
 
     @classmethod
     def load_updated_at(cls, update_all: bool = False) -> str:
         if update_all:
-            updated_at = datetime.now(cls.timezone) - timedelta(days=365 * 3)
-            return updated_at.strftime('%Y-%m-%dT%H:%M:%S.%f%Z')
-        load_dotenv(find_dotenv())
-        last_run_date = os.getenv(cls.updated_at_key)
-        if last_run_date:
-            return last_run_date
-        else:
-            updated_at = datetime.now(cls.timezone) - timedelta(days=365 * 3)
-            return updated_at.strftime('%Y-%m-%dT%H:%M:%S.%f%Z')
+            return cls._default_updated_at()
+        return cls.updated_at_watermark.get() or cls._default_updated_at()
 
     @classmethod
     def load_updated_at_leads(cls, update_all: bool = False) -> str:
         if update_all:
-            updated_at = datetime.now(cls.timezone) - timedelta(days=365 * 3)
-            return updated_at.strftime('%Y-%m-%dT%H:%M:%S.%f%Z')
-        load_dotenv(find_dotenv())
-        last_run_date = os.getenv(cls.lead_updated_at_key)
-        if last_run_date:
-            return last_run_date
-        else:
-            updated_at = datetime.now(cls.timezone) - timedelta(days=365 * 3)
-            return updated_at.strftime('%Y-%m-%dT%H:%M:%S.%f%Z')
+            return cls._default_updated_at()
+        return cls.lead_updated_at_watermark.get() or cls._default_updated_at()
 
     @classmethod
-    def set_updated_at_leads(cls, updated_at: datetime):
-        set_key(
-            '.env',
-            cls.lead_updated_at_key,
+    def set_updated_at_leads(cls,
+                             updated_at: datetime,
+                             expected: str | None = None,
+                             fence: int | None = None) -> bool:
+        return cls.lead_updated_at_watermark.advance(
             updated_at.strftime('%Y-%m-%dT%H:%M:%S.%f%Z'),
+            expected,
+            fence,
         )
 
     @classmethod
-    def set_updated_at(cls, updated_at: datetime):
-        set_key(
-            '.env',
-            cls.updated_at_key,
+    def set_updated_at(cls,
+                       updated_at: datetime,
+                       expected: str | None = None,
+                       fence: int | None = None) -> bool:
+        return cls.updated_at_watermark.advance(
             updated_at.strftime('%Y-%m-%dT%H:%M:%S.%f%Z'),
+            expected,
+            fence,
         )
 
     @classmethod
@@ -75,18 +75,33 @@ class NotionRepo:
                 **kw,
             )
             for item in resp.get('results', []):
-                items.append(Item.from_response(item))
+                items.append(cls._parse_item(item))
             print('Items loaded from Notion:', len(items))
             if not resp['has_more']:
                 break
+            ensure_lease()
             kw['start_cursor'] = resp['next_cursor']
         return items
 
+    @classmethod
+    def _parse_item(cls, resp: dict) -> Item:
+        # страница не менялась с прошлого разбора - берём из кеша без повторной загрузки фото,
+        # иначе разбираем заново и обновляем кеш
+        cached = cls.items_cache.peek(resp['id'])
+        if cached is not None and cached.last_edited_time == resp.get('last_edited_time'):
+            return cached.model_copy(deep=True)
+        item = Item.from_response(resp)
+        cls.items_cache.set(item.id, item.model_copy(deep=True))
+        return item
+
     @classmethod
     def get_item_by_id(cls, id: str) -> Item | None:
+        cached = cls.items_cache.get(id)
+        if cached is not None:
+            return cached.model_copy(deep=True)
         try:
             resp = cls.client.pages.retrieve(id)
-            return Item.from_response(resp)
+            return cls._parse_item(resp)
         except APIResponseError:
             return None
 
@@ -157,11 +172,12 @@ class NotionRepo:
             print('Leads loaded from Notion:', len(leads))
             if not resp['has_more']:
                 break
+            ensure_lease()
             kw['start_cursor'] = resp['next_cursor']
         return leads
 
     @classmethod
-    def load_updated_leads(cls, update_all: bool = False) -> list[LeadUpdate]:
+    def load_updated_leads(cls, update_all: bool = False, fence: int | None = None) -> list[LeadUpdate]:
         updated_at = cls.load_updated_at_leads(update_all)
         filter = {
             'and': [
@@ -183,8 +199,8 @@ class NotionRepo:
         leads = cls.get_leads(filter)
         print('Leads loaded from Notion:', len(leads))
         print('Time elapsed:', datetime.now(cls.timezone) - time_start)
-        if not update_all:
-            cls.set_updated_at_leads(time_start)
+        if not update_all and not cls.set_updated_at_leads(time_start, expected=updated_at, fence=fence):
+            print('Leads watermark was moved by another sync, keeping it')
         return leads
 
     @classmethod
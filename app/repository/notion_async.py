@@ -0,0 +1,136 @@
+import asyncio
+
+from typing import Any, Awaitable, Callable, TypeVar
+
+from notion_client import AsyncClient, APIResponseError
+
+from app.core import settings
+from app.crud.models.lead_item import LeadItem
+from app.repository.notion import NotionRepo
+from app.schemas import AMODTProduct
+from app.schemas.notion import *
+from app.utils.aio import run_sync
+
+T = TypeVar('T')
+
+
+class AsyncNotionRepo:
+    """
+    Асинхронный вариант NotionRepo для массовых операций над страницами.
+
+    Количество одновременных запросов к Notion ограничено семафором (NOTION_CONCURRENCY).
+    Клиент живёт в пределах одного event loop, поэтому из синхронного кода репозиторий
+    используется через run:
+
+    AsyncNotionRepo.run(lambda repo: repo.set_deleted_many(items))
+    """
+
+    def __init__(self, concurrency: int = settings.NOTION_CONCURRENCY):
+        self.client = AsyncClient(auth=settings.NOTION_SECRET)
+        self.semaphore = asyncio.Semaphore(concurrency)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.client.aclose()
+
+    @classmethod
+    def run(cls, func: Callable[['AsyncNotionRepo'], Awaitable[T]]) -> T:
+        async def wrapper() -> T:
+            async with cls() as repo:
+                return await func(repo)
+        return run_sync(wrapper())
+
+    @staticmethod
+    async def gather(*aws: Awaitable[Any]) -> list[Any]:
+        # дожидаемся всех запросов, ошибки возвращаются на месте результата,
+        # чтобы вызывающий код мог сохранить успешные и пробросить первую ошибку через check
+        return await asyncio.gather(*aws, return_exceptions=True)
+
+    @staticmethod
+    def check(results: list[Any]) -> list[Any]:
+        for result in results:
+            if isinstance(result, Exception):
+                raise result
+        return results
+
+    async def _call(self, method: Callable[..., Awaitable[Any]], *args, **kwargs) -> Any:
+        async with self.semaphore:
+            return await method(*args, **kwargs)
+
+    async def get_item_by_id(self, id: str) -> Item | None:
+        cached = NotionRepo.items_cache.get(id)
+        if cached is not None:
+            return cached.model_copy(deep=True)
+        try:
+            resp = await self._call(self.client.pages.retrieve, id)
+        except APIResponseError:
+            return None
+        return await asyncio.to_thread(NotionRepo._parse_item, resp)
+
+    async def get_items_by_ids(self, ids: list[str]) -> list[Item | None]:
+        return self.check(await self.gather(*(self.get_item_by_id(id) for id in ids)))
+
+    async def set_deleted(self, item: Item):
+        await self._call(
+            self.client.pages.update,
+            page_id=item.id,
+            properties={
+                'Каталог статус': {
+                    'type': 'status',
+                    'status': {'name': ItemStatus.off},
+                },
+            },
+        )
+
+    async def set_deleted_many(self, items: list[Item]) -> list[Exception | None]:
+        return await self.gather(*(self.set_deleted(item) for item in items))
+
+    async def update_lead_item_partial(self,
+                                       item: AMODTProduct,
+                                       db_item: LeadItem,
+                                       lead_uid: str):
+        properties = item.to_notion_partial_update(
+            db_item.notion_nid,
+            db_item.notion_lead_nid,
+            lead_uid,
+        )
+        try:
+            await self._call(
+                self.client.pages.update,
+                page_id=db_item.notion_uid,
+                properties=properties,
+            )
+        except APIResponseError as e:
+            if 'archived' in str(e):
+                await self._call(
+                    self.client.pages.update,
+                    page_id=db_item.notion_uid,
+                    archived=False,
+                )
+                await self._call(
+                    self.client.pages.update,
+                    page_id=db_item.notion_uid,
+                    properties=properties,
+                )
+            else:
+                raise e
+
+    async def update_lead_items_partial(self,
+                                        updates: list[tuple[AMODTProduct, LeadItem, str]],
+                                        ) -> list[Exception | None]:
+        return await self.gather(*(
+            self.update_lead_item_partial(item, db_item, lead_uid)
+            for item, db_item, lead_uid in updates
+        ))
+
+    async def archive(self, uid: str):
+        await self._call(
+            self.client.pages.update,
+            page_id=uid,
+            archived=True,
+        )
+
+    async def archive_many(self, uids: list[str]) -> list[Exception | None]:
+        return await self.gather(*(self.archive(uid) for uid in uids))
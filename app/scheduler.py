@@ -0,0 +1,13 @@
+from app.job.scheduler import Scheduler
+from app.job.sync import catalog_job, catalog_full_job, leads_job, mirror_job
+from app.repository.tgbot import Alert
+
+
+if __name__ == "__main__":
+    Alert.critical('`🟢 Планировщик синхронизаций запущен.`')
+    Scheduler([
+        catalog_job,
+        catalog_full_job,
+        leads_job,
+        mirror_job,
+    ]).run()
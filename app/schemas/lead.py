@@ -6,6 +6,7 @@ from datetime import datetime, timezone, timedelta
 from pydantic import BaseModel, model_validator
 
 from app.repository.tgbot import Alert
+from app.utils.form import parse_form
 
 
 class NotionLead(BaseModel):
@@ -462,44 +463,6 @@ class LeadUpdate(BaseModel):
         return LeadUpdate(**result)
 
 
-def build_nested_dict(flat_dict):
-    def set_nested_value(d, keys, value):
-        for key in keys[:-1]:
-            if key.isdigit():
-                key = int(key)
-                if isinstance(d, list):
-                    if len(d) <= key:
-                        d.extend([{}] * (key - len(d) + 1))
-                    d = d[key]
-                else:
-                    d[key] = d.get(key, {})
-                    d = d[key]
-            else:
-                if key not in d or not isinstance(d[key], dict):
-                    d[key] = {}
-                d = d[key]
-
-        last_key = keys[-1]
-        if last_key.isdigit():
-            last_key = int(last_key)
-            if isinstance(d, list):
-                if len(d) <= last_key:
-                    d.extend([None] * (last_key - len(d) + 1))
-                d[last_key] = value
-            else:
-                d[last_key] = value
-        else:
-            d[last_key] = value
-
-    nested_dict = {}
-
-    for key, value in flat_dict.items():
-        parts = key.replace(']', '').split('[')
-        set_nested_value(nested_dict, parts, value)
-
-    return nested_dict
-
-
 def transform_custom_fields(fields: dict):
     transformed = {}
     for field_index, field_data in fields.items():
@@ -509,9 +472,8 @@ def transform_custom_fields(fields: dict):
     return transformed
 
 
-def parse_lead_update(data) -> Lead | None:
-    data = {k: v[0] if len(v) == 1 else v for k, v in data.items()}
-    data = build_nested_dict(data)
+def parse_lead_update(body: bytes) -> Lead | None:
+    data = parse_form(body)
     update = data.get('leads', {}).get('update', {})
     if not update:
         return
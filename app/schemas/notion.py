@@ -1,10 +1,10 @@
 from __future__ import annotations
 from enum import Enum
 
-from pydantic import BaseModel
+from pydantic import BaseModel, PrivateAttr
 
 from app.repository.tgbot import Alert
-from app.utils.file_storage import save_file_from_url
+from app.utils.file_storage import media_pool
 
 
 class ItemStatus(str, Enum):
@@ -53,6 +53,8 @@ class Item(BaseModel):
     subproducts_ids: list[str] | None = None
     main_item: str = ''
 
+    _photo_source: str = PrivateAttr('')  # ссылка на фото в Notion, ещё не зеркалированное
+
     @classmethod
     def from_response(cls, resp: dict) -> Item:
         props = resp['properties']
@@ -66,13 +68,8 @@ class Item(BaseModel):
         result['variants'] = cls.getter(props, 'Вариации', 'formula', 'string')
         result['tags'] = cls.getter(props, 'Теги формула', 'formula', 'string')
         result['sizes'] = cls.getter(props, 'Размеры формула', 'formula', 'string')
-        result['photo'] = cls.getter(props, 'Фото формула', 'formula', 'string')
-        if result['photo'] != '':
-            try:
-                result['photo'] = save_file_from_url(result['photo'], f"{result['nid']}.jpg")
-            except Exception as e:
-                Alert.critical(f'Ошибка загрузки фото с Notion: {e}')
-                result['photo'] = ''
+        # фото зеркалируется лениво, итоговая ссылка появится в resolve_photo
+        photo_source = cls.getter(props, 'Фото формула', 'formula', 'string')
         result['photo_all'] = cls.getter(props, 'Фото все формула', 'formula', 'string')
         result['description'] = cls.getter(props, 'Описание формула', 'formula', 'string')
         main_price = cls.getter(props, 'Цена (основная)', 'number')
@@ -105,7 +102,34 @@ class Item(BaseModel):
             result['main_item'] = relation['id']
         result['linked_ids'] = linked_products
         result['subproducts_ids'] = subproducts_ids
-        return cls(**result)
+        item = cls(**result)
+        item._photo_source = photo_source
+        return item
+
+    def prefetch_photo(self):
+        """Ставит фото в фоновую загрузку, если оно понадобится позже."""
+        if self._photo_source:
+            media_pool.submit(self._photo_source, f'{self.nid}.jpg')
+
+    @classmethod
+    def prefetch_photos(cls, items: list[Item]):
+        for item in items:
+            item.prefetch_photo()
+
+    def photo_identity(self) -> str:
+        """Ссылка на фото без подписи: у файлов Notion query меняется при каждом запросе страницы."""
+        return (self._photo_source or self.photo).split('?')[0]
+
+    def resolve_photo(self) -> str:
+        """Зеркалирует фото из Notion (не больше одного раза) и возвращает публичную ссылку на него."""
+        if self._photo_source:
+            try:
+                self.photo = media_pool.result(self._photo_source, f'{self.nid}.jpg')
+            except Exception as e:
+                Alert.critical(f'Ошибка загрузки фото с Notion: {e}')
+                self.photo = ''
+            self._photo_source = ''
+        return self.photo
 
     @staticmethod
     def getter(values: dict, *fields: str) -> str | int | bool | list[dict] | None:
@@ -6,14 +6,16 @@ import json
 import requests
 
 from datetime import datetime, timezone
+from functools import cached_property
+from typing import Any, ClassVar
 
-from pydantic import BaseModel, model_validator
+from pydantic import BaseModel, PrivateAttr, model_validator
 
 from .api import LeadAddItemRequest
-from .lead import build_nested_dict
 from .notion import Item, ItemStatus
 
 from app.utils.file_storage import save_file_from_url
+from app.utils.form import parse_form
 from app.core import settings
 
 
@@ -68,18 +70,37 @@ class AMODTProduct(BaseModel):
     description: str = ''
     custom_fields_values: list[dict]
 
+    _photo: str | None = PrivateAttr(None)
+
     def hash(self) -> str:
         dict_str = json.dumps(self.dict(), sort_keys=True)
         return hashlib.md5(dict_str.encode('utf-8')).hexdigest()
 
-    def lead_id(self) -> int:
+    @cached_property
+    def _fields(self) -> dict[int, list]:
+        # индекс field_id -> значения, чтобы аксессоры не обходили custom_fields_values каждый раз.
+        # cached_property, а не PrivateAttr: чтение приватного атрибута pydantic идёт через
+        # __getattr__ и стоит дороже самого поиска по списку полей
+        fields = {}
         for field in self.custom_fields_values:
-            if int(field['field_id']) == 1450239:
-                try:
-                    return int(field['values'][0]['values'][0]['value'])
-                except KeyError:
-                    return int(field['values'][0]['value'])
-        return 0
+            try:
+                value = field['values'][0]
+                # в хуках значение вложено ещё на уровень: values[0].values[0].value
+                if 'values' in value:
+                    value = value['values'][0]
+                value = value['value']
+            except (KeyError, IndexError, TypeError):
+                continue
+            fields.setdefault(int(field['field_id']), []).append(value)
+        return fields
+
+    def _field(self, field_id: int, default: Any = None) -> Any:
+        values = self._fields.get(field_id)
+        return values[-1] if values else default
+
+    def lead_id(self) -> int:
+        values = self._fields.get(1450239)
+        return int(values[0]) if values else 0
 
     def to_notion_partial_update(self,
                                  item_notion_id: str | int,
@@ -359,119 +380,50 @@ class AMODTProduct(BaseModel):
         )
 
     def get_description(self):
-        result = ''
-        for field in self.custom_fields_values:
-            if int(field['field_id']) == 1110355:
-                try:
-                    result = field['values'][0]['values'][0]['value']
-                except KeyError:
-                    result = field['values'][0]['value']
-        return result
+        return self._field(1110355, '')
 
     def get_price(self):
-        result = None
-        for field in self.custom_fields_values:
-            if int(field['field_id']) == 1110357:
-                try:
-                    result = int(field['values'][0]['values'][0]['value'])
-                except KeyError:
-                    result = int(field['values'][0]['value'])
-        return result
+        result = self._field(1110357)
+        return int(result) if result is not None else None
 
     def get_count(self):
-        result = None
-        for field in self.custom_fields_values:
-            if int(field['field_id']) == 1450277:
-                try:
-                    result = int(field['values'][0]['values'][0]['value'])
-                except KeyError:
-                    result = int(field['values'][0]['value'])
-        return result
+        result = self._field(1450277)
+        return int(result) if result is not None else None
 
     def get_agent_price(self):
-        result = None
-        for field in self.custom_fields_values:
-            if int(field['field_id']) == 1450223:
-                try:
-                    result = int(field['values'][0]['values'][0]['value'])
-                except KeyError:
-                    result = int(field['values'][0]['value'])
-        return result
+        result = self._field(1450223)
+        return int(result) if result is not None else None
 
     def get_sizes(self):
-        result = ''
-        for field in self.custom_fields_values:
-            if int(field['field_id']) == 1447011:
-                try:
-                    result = field['values'][0]['values'][0]['value']
-                except KeyError:
-                    result = field['values'][0]['value']
-        return result
+        return self._field(1447011, '')
 
     def get_note(self):
-        result = ''
-        for field in self.custom_fields_values:
-            if int(field['field_id']) == 1450287:
-                try:
-                    result = field['values'][0]['values'][0]['value']
-                except KeyError:
-                    result = field['values'][0]['value']
-        return result
+        return self._field(1450287, '')
 
     def get_count_for_invoice(self):
-        result = 0
-        for field in self.custom_fields_values:
-            if int(field['field_id']) == 1450285:
-                try:
-                    result = int(field['values'][0]['values'][0]['value'])
-                except KeyError:
-                    result = int(field['values'][0]['value'])
-        return result
+        return int(self._field(1450285, 0))
 
     def get_nid(self) -> str:
-        result = ''
-        for field in self.custom_fields_values:
-            if int(field['field_id']) == 1450219:
-                try:
-                    result = field['values'][0]['values'][0]['value']
-                except KeyError:
-                    result = field['values'][0]['value']
-        return result
+        return self._field(1450219, '')
 
     def get_photo(self):
-        result = None
-        for field in self.custom_fields_values:
-            if int(field['field_id']) == 1450227:
-                try:
-                    result = field['values'][0]['values'][0]['value']
-                except KeyError:
-                    result = field['values'][0]['value']
+        # фото зеркалируется один раз на объект, дальше берём запомненную ссылку
+        if self._photo is not None:
+            return self._photo
+        result = self._field(1450227)
         if result is not None:
             if 'api.cehcom.kz' not in result or 'api.cehcom.kz/media/default' in result:
                 result = save_file_from_url(result, f'{self.get_nid()}.jpg')
         else:
             result = save_file_from_url(settings.DEFAULT_PHOTO, f'{self.get_nid()}.jpg')
+        self._photo = result
         return result
 
     def get_notion_parent_uid(self) -> list:
-        result = []
-        for field in self.custom_fields_values:
-            if int(field['field_id']) == 1450635:
-                try:
-                    result.append(field['values'][0]['values'][0]['value'])
-                except KeyError:
-                    result.append(field['values'][0]['value'])
-        return result
+        return list(self._fields.get(1450635, []))
 
     def get_notion_uid(self) -> list:
-        result = []
-        for field in self.custom_fields_values:
-            if int(field['field_id']) == 1450221:
-                try:
-                    result.append(field['values'][0]['values'][0]['value'])
-                except KeyError:
-                    result.append(field['values'][0]['value'])
-        return result
+        return list(self._fields.get(1450221, []))
 
 
 class AMOProduct(BaseModel):
@@ -540,8 +492,28 @@ class AMOProduct(BaseModel):
             main_item=get_custom_field_value(1450637),
         )
 
+    # поля, которые меняются при любой правке карточки и сами по себе не повод патчить товар
+    volatile_fields: ClassVar[frozenset[int]] = frozenset({1450177, 1450189})
+
+    @classmethod
+    def payload_hash(cls, item: Item) -> str:
+        """
+        Отпечаток того, что уйдёт в amoCRM для товара, без скачивания фото:
+        вместо зеркалированной ссылки берётся ссылка на источник.
+        """
+        product = cls.from_notion_item(item, photo=item.photo_identity())
+        payload = {
+            'name': product.name,
+            'custom_fields_values': [
+                field for field in product.custom_fields_values
+                if field['field_id'] not in cls.volatile_fields
+            ],
+        }
+        dict_str = json.dumps(payload, sort_keys=True, default=str)
+        return hashlib.md5(dict_str.encode('utf-8')).hexdigest()
+
     @classmethod
-    def from_notion_item(cls, item: Item) -> AMOProduct:
+    def from_notion_item(cls, item: Item, photo: str | None = None) -> AMOProduct:
         dt = datetime.strptime(
             item.created,
             '%Y-%m-%dT%H:%M:%S.%fZ'
@@ -593,7 +565,7 @@ class AMOProduct(BaseModel):
             {
                 'field_id': 1450159,
                 'values': [
-                    {'value': item.photo},
+                    {'value': item.resolve_photo() if photo is None else photo},
                 ],
             },
             {
@@ -719,40 +691,23 @@ class AMOProduct(BaseModel):
         )
 
 
-def transform_custom_fields_values(fields: dict):
-    transformed = []
-    for field_index, field_data in fields.items():
-        field_id = field_data['id']
-        field_data.pop('id')
-        transformed.append({
-            'field_id': field_id,
-            'values': [field_data],
-        })
-    return transformed
-
-
-def parse_dt_product_update(data) -> tuple[list[AMODTProduct], list[AMODTProduct], list[int]]:
-    data = {k: v[0] if len(v) == 1 else v for k, v in data.items()}
-    data = build_nested_dict(data)
-
-    add_dts, update_dts, delete_dts = [], [], []
-
-    catalogs = data.get('catalogs', {})
-    add_items = catalogs.get('add', {})
-    update_items = catalogs.get('update', {})
-    delete_items = catalogs.get('delete', {})
-
-    for item in add_items.values():
-        item['custom_fields_values'] = transform_custom_fields_values(item['custom_fields'])
-        item = AMODTProduct(**item)
-        add_dts.append(item)
-
-    for item in update_items.values():
-        item['custom_fields_values'] = transform_custom_fields_values(item['custom_fields'])
-        item = AMODTProduct(**item)
-        update_dts.append(item)
-
-    for item in delete_items.items():
-        delete_dts.append(int(item[1]['id']))
-
+def _dt_product_from_hook(item: dict) -> AMODTProduct:
+    # поля хука уже разобраны parse_form: собираем custom_fields_values за один проход
+    # и строим модель без повторной валидации вложенных словарей
+    custom_fields_values = []
+    for field in item.get('custom_fields', {}).values():
+        field_id = field.pop('id')
+        custom_fields_values.append({'field_id': field_id, 'values': [field]})
+    return AMODTProduct.model_construct(
+        id=int(item.get('id', 0)),
+        name=item.get('name', ''),
+        custom_fields_values=custom_fields_values,
+    )
+
+
+def parse_dt_product_update(body: bytes) -> tuple[list[AMODTProduct], list[AMODTProduct], list[int]]:
+    catalogs = parse_form(body).get('catalogs', {})
+    add_dts = [_dt_product_from_hook(item) for item in catalogs.get('add', {}).values()]
+    update_dts = [_dt_product_from_hook(item) for item in catalogs.get('update', {}).values()]
+    delete_dts = [int(item['id']) for item in catalogs.get('delete', {}).values()]
     return add_dts, update_dts, delete_dts
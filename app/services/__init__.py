@@ -1,2 +1,3 @@
 from .notion import NotionService
 from .amocrm import AMOService
+from .catalog import CatalogService
@@ -1,23 +1,81 @@
 import time
 
+from contextlib import contextmanager
+from typing import Iterator
+
+from app.core import settings
+from app.core.config import red
 from app.crud.schemas import LeadCreate, LeadItemCreate
 from app.repository.amocrm import AmoRepo
 from app.repository.notion import NotionRepo
+from app.repository.notion_async import AsyncNotionRepo
 from app.repository.tgbot import Alert
 from app.crud import (
     lead as lead_crud,
     lead_item as lead_item_crud,
+    end_read,
+    unit_of_work,
 )
 from app.schemas import AMODTProduct
 from app.schemas.lead import Lead
+from app.utils.lock import LeaseLock
+
+
+def drafts_lock(key: str) -> LeaseLock:
+    # черновик в Notion - первый по порядку, без отметки о захвате: пока один поток его
+    # заполняет, другой получит тот же черновик, поэтому захват и заполнение идут по одному
+    return LeaseLock(red, key, settings.SYNC_LEASE_SECONDS)
+
+
+class PendingWrites:
+    """Записи в бд, накопленные за обработку хука, см. AMOService.deferred_writes."""
+
+    def __init__(self):
+        self.leads: dict[int, LeadCreate] = {}  # amo_id -> новая сделка
+        self.lead_hashes: dict[int, str] = {}  # id -> data_hash
+        self.created: dict[tuple[int, int], LeadItemCreate] = {}
+        self.quantities: dict[tuple[int, int], int] = {}
+        self.item_hashes: dict[tuple[int, int], str] = {}
+        self.archived: list[int] = []
 
 
 class AMOService:
 
     def __init__(self, db):
         self.db = db
+        self._pending: PendingWrites | None = None
 
-    def process_lead_update_hook(self, lead: Lead):
+    @contextmanager
+    def deferred_writes(self) -> Iterator[PendingWrites]:
+        """
+        Записи копятся, пока идут вызовы notion/amoCRM, и фиксируются одной короткой транзакцией
+        в конце внешнего блока, поэтому транзакция не держит строки на время внешних запросов.
+        Сохраняется и то, что уже сделано в notion до ошибки. Вложенный блок пишет во внешний.
+        """
+        if self._pending is not None:
+            yield self._pending
+            return
+        self._pending = pending = PendingWrites()
+        try:
+            yield pending
+        finally:
+            self._pending = None
+            with unit_of_work(self.db):
+                lead_crud.upsert_by_amo_id(self.db, list(pending.leads.values()))
+                lead_crud.update_hashes(self.db, pending.lead_hashes)
+                lead_item_crud.upsert_many(self.db, list(pending.created.values()))
+                lead_item_crud.update_quantities(self.db, pending.quantities)
+                lead_item_crud.update_hashes(self.db, pending.item_hashes)
+                lead_item_crud.delete_by_item_ids(self.db, pending.archived)
+
+    def _is_tracked(self, lead_id: int) -> bool:
+        # сделка, заведённая в этом же блоке, ещё не записана в бд
+        if self._pending is not None and lead_id in self._pending.leads:
+            return True
+        return lead_crud.get_by_amo_id(self.db, lead_id) is not None
+
+    def process_lead_update_hook(self, lead: Lead, wait_quantity: bool = True) -> bool:
+        """Возвращает True, если сделка только что заведена и её товары уже загружены."""
         # смотрим заполнено ли поле сделки "П-статус"
         #   смотрим есть ли сделка в бд
         #       если нет:
@@ -26,23 +84,28 @@ class AMOService:
         #       иначе:
         #           обновляем в notion
         #
-        if lead.p_status() is not None:
+        if lead.p_status() is None:
+            return False
+        with self.deferred_writes() as pending:
             db_lead = lead_crud.get_by_amo_id(self.db, lead.id)
             if db_lead is None:  # создаем лида из черновика
-                uid = NotionRepo.get_lead_template()
-                if uid is None:
-                    Alert.critical('`🛑 Создайте черновики п-сделок!`')
-                    return
-                else:
+                with drafts_lock('notion-lead-drafts').held(settings.NOTION_DRAFT_LOCK_TIMEOUT):
+                    uid = NotionRepo.get_lead_template()
+                    if uid is None:
+                        Alert.critical('`🛑 Создайте черновики п-сделок!`')
+                        return False
                     notion_item = NotionRepo.update_lead(lead, uid)
-                lead_crud.create(self.db, LeadCreate(amo_id=lead.id, notion_uid=uid, data_hash=lead.hash()))
+                pending.leads[lead.id] = LeadCreate(amo_id=lead.id, notion_uid=uid, data_hash=lead.hash())
                 AmoRepo.update_lead_fields(lead.id, notion_item.to_amo_update(lead.id))
-                self._load_lead_items(lead.id)
-            elif lead.hash() != db_lead.data_hash:  # обновляем лида если изменены данные
-                lead_crud.update_hash(self.db, db_lead.id, lead.hash())
+                self._load_lead_items(lead.id, wait_quantity)
+                return True
+            if lead.hash() != db_lead.data_hash:  # обновляем лида если изменены данные
+                # хеш пишем после notion, чтобы он не сохранился, если notion не обновился
                 NotionRepo.update_lead(lead, db_lead.notion_uid)
+                pending.lead_hashes[db_lead.id] = lead.hash()
+        return False
 
-    def _load_lead_items(self, lead_id: int):
+    def _load_lead_items(self, lead_id: int, wait_quantity: bool = True):
         db_lead_items = dict(lead_item_crud.get_by_lead_id(self.db, lead_id))
         amo_lead_items, _, _ = AmoRepo.get_lead_items_ids(lead_id)
         create_items_ids, update_items_ids = [], []
@@ -53,65 +116,86 @@ class AMOService:
                 create_items_ids.append(amo_item_id)
         create_items = AmoRepo.get_lead_products(create_items_ids)
         update_items = AmoRepo.get_lead_products(update_items_ids)
-        self.process_dt_products_update(create_items, update_items)
-
-    def sync_lead_items(self, lead_id: int):
-        amo_items, _, _ = AmoRepo.get_lead_items_ids(lead_id)
-        current_items = lead_item_crud.get_by_lead_id_with_uid(self.db, lead_id)
-        amo_items = dict(amo_items)
-        current_items = dict(current_items)
-        add_items_ids = []
-        update_items_ids = []
-        for item_id, quantity in amo_items.items():
-            curr_quantity, current_item_uid = current_items.get(item_id, (None, None))
-            if current_item_uid is not None:
-                if curr_quantity != quantity:
-                    NotionRepo.update_quantity(current_item_uid, int(quantity))
-                    lead_item_crud.update_quantity(self.db, lead_id, item_id, quantity)
-                update_items_ids.append(int(item_id))
-            else:
-                add_items_ids.append(int(item_id))
-        for item_id, pair in current_items.items():
-            _, uid = pair
-            if item_id not in amo_items:
-                NotionRepo.unlink_item_from_lead(uid)
-        create_items = AmoRepo.get_lead_products(add_items_ids)
-        update_items = AmoRepo.get_lead_products(update_items_ids)
-        self.process_dt_products_update(
-            create_items,
-            update_items,
-            check_hash=False,
-        )
+        self.process_dt_products_update(create_items, update_items, wait_quantity=wait_quantity)
+
+    def sync_lead_items(self,
+                        lead_id: int,
+                        deleted: list[int] | None = None,
+                        check_hash: bool = False,
+                        wait_quantity: bool = True):
+        with self.deferred_writes() as pending:
+            # сначала архивируем удалённые товары, чтобы не отвязывать их повторно
+            if deleted:
+                self._archive_dt_products(deleted, pending.archived)
+            amo_items, _, _ = AmoRepo.get_lead_items_ids(lead_id)
+            current_items = lead_item_crud.get_by_lead_id_with_uid(self.db, lead_id)
+            amo_items = dict(amo_items)
+            current_items = dict(current_items)
+            # архивированные в этом блоке ещё есть в бд
+            for item_id in pending.archived:
+                current_items.pop(item_id, None)
+            add_items_ids = []
+            update_items_ids = []
+            for item_id, quantity in amo_items.items():
+                curr_quantity, current_item_uid = current_items.get(item_id, (None, None))
+                if current_item_uid is not None:
+                    if curr_quantity != quantity:
+                        NotionRepo.update_quantity(current_item_uid, int(quantity))
+                        pending.quantities[(lead_id, item_id)] = quantity
+                    update_items_ids.append(int(item_id))
+                else:
+                    add_items_ids.append(int(item_id))
+            for item_id, pair in current_items.items():
+                _, uid = pair
+                if item_id not in amo_items:
+                    NotionRepo.unlink_item_from_lead(uid)
+            create_items = AmoRepo.get_lead_products(add_items_ids)
+            update_items = AmoRepo.get_lead_products(update_items_ids)
+            self.process_dt_products_update(
+                create_items,
+                update_items,
+                check_hash=check_hash,
+                wait_quantity=wait_quantity,
+            )
 
     def process_dt_products_update(self,
                                    added: list[AMODTProduct],
                                    updated: list[AMODTProduct],
                                    deleted: list[int] | None = None,
-                                   check_hash: bool = True):
+                                   check_hash: bool = True,
+                                   wait_quantity: bool = True):
+        with self.deferred_writes() as pending:
+            self._create_dt_products(added, updated, pending.created, wait_quantity)
+            self._update_dt_products(updated, pending.created, pending.item_hashes, check_hash)
+            if deleted is not None:
+                self._archive_dt_products(deleted, pending.archived)
+
+    def _create_dt_products(self,
+                            added: list[AMODTProduct],
+                            updated: list[AMODTProduct],
+                            created: dict[tuple[int, int], LeadItemCreate],
+                            wait_quantity: bool):
         # создание новых товаров сделки
-        if len(added) > 0:  # если создались новые товары - ждём 2с обновления количества
+        if wait_quantity and len(added) > 0:  # если создались новые товары - ждём 2с обновления количества
+            end_read(self.db)
             time.sleep(2)
         for item in added:
             lead_id = item.lead_id()
             if lead_id == 0:
                 continue
             # проверка присутствия в бд лида
-            db_lead = lead_crud.get_by_amo_id(self.db, lead_id)
-            if db_lead is None:
+            if not self._is_tracked(lead_id):
                 continue
             # проверка присутствия в бд айтема
             db_lead_items = lead_item_crud.get_by_lead_id(self.db, lead_id)
             db_lead_items = dict(db_lead_items)
-            # если есть - переносим в обновление
+            # если есть - переносим в обновление, повтор созданного в этом вызове пропускаем
+            if (lead_id, item.id) in created:
+                continue
             if item.id in db_lead_items:
                 updated.append(item)
                 continue
 
-            uid, notion_item_id = NotionRepo.get_lead_item_template()
-            if uid is None or notion_item_id is None:
-                Alert.critical('`🛑 Создайте черновики п-заказов!`')
-                continue
-
             # запрашиваем quantity и айди лида ноушена товара
             quantity = None
             amo_lead_items, notion_item_lead_id, lead_uid = AmoRepo.get_lead_items_ids(lead_id)
@@ -123,30 +207,37 @@ class AMOService:
                 continue
 
             # добавляем п-заказ в notion
-            notion_item = NotionRepo.update_lead_item(
-                item, uid, notion_item_id, notion_item_lead_id, lead_uid, quantity
-            )
-            # сохраняем в базу
-            lead_item_crud.create(
-                self.db,
-                LeadItemCreate(
-                    lead_id=lead_id,
-                    item_id=item.id,
-                    quantity=quantity,
-                    notion_uid=uid,
-                    notion_nid=notion_item_id,
-                    notion_lead_nid=notion_item_lead_id,
-                    data_hash=item.hash(),
-                ),
+            with drafts_lock('notion-lead-item-drafts').held(settings.NOTION_DRAFT_LOCK_TIMEOUT):
+                uid, notion_item_id = NotionRepo.get_lead_item_template()
+                if uid is None or notion_item_id is None:
+                    Alert.critical('`🛑 Создайте черновики п-заказов!`')
+                    continue
+                notion_item = NotionRepo.update_lead_item(
+                    item, uid, notion_item_id, notion_item_lead_id, lead_uid, quantity
+                )
+            created[(lead_id, item.id)] = LeadItemCreate(
+                lead_id=lead_id,
+                item_id=item.id,
+                quantity=quantity,
+                notion_uid=uid,
+                notion_nid=notion_item_id,
+                notion_lead_nid=notion_item_lead_id,
+                data_hash=item.hash(),
             )
             # обновляем товар в амо
             AmoRepo.update_lead_item_after_creation(
                 item.id, notion_item.to_amo_update(item.id))
 
+    def _update_dt_products(self,
+                            updated: list[AMODTProduct],
+                            created: dict[tuple[int, int], LeadItemCreate],
+                            hashes: dict[tuple[int, int], str],
+                            check_hash: bool):
         # обновление товаров сделки из amo -> notion
+        partial_updates = []
         for item in updated:
             lead_id = item.lead_id()
-            if lead_id == 0:
+            if lead_id == 0 or (lead_id, item.id) in created:
                 continue
             # проверка присутствия в бд
             db_lead_item = lead_item_crud.get_by_lead_id_item_id(self.db, lead_id, item.id)
@@ -155,16 +246,26 @@ class AMOService:
             # проверяем хеш
             if check_hash and db_lead_item.data_hash == item.hash():
                 continue
-            # обновление в notion с lead_uid
             lead_uid = lead_crud.get_uid_by_amo_id(self.db, lead_id)
-            NotionRepo.update_lead_item_partial(item, db_lead_item, lead_uid)
-            # сохранение хеша
-            lead_item_crud.update_hash(self.db, db_lead_item.lead_id, db_lead_item.item_id, item.hash())
+            partial_updates.append((item, db_lead_item, lead_uid))
+        # обновление в notion с lead_uid параллельно
+        results = []
+        if partial_updates:
+            results = AsyncNotionRepo.run(lambda repo: repo.update_lead_items_partial(partial_updates))
+        for (item, db_lead_item, _), result in zip(partial_updates, results):
+            if isinstance(result, Exception):
+                continue
+            hashes[(db_lead_item.lead_id, db_lead_item.item_id)] = item.hash()
             print('Updated lead item:', item.id)
+        AsyncNotionRepo.check(results)
 
-        if deleted is not None:
-            items = lead_item_crud.get_by_item_ids(self.db, deleted)
-            for item in items:
-                NotionRepo.archive(item.notion_uid)
+    def _archive_dt_products(self, deleted: list[int], archived: list[int]):
+        items = lead_item_crud.get_by_item_ids(self.db, deleted)
+        results = []
+        if items:
+            results = AsyncNotionRepo.run(lambda repo: repo.archive_many([item.notion_uid for item in items]))
+        for item, result in zip(items, results):
+            if not isinstance(result, Exception):
+                archived.append(item.item_id)
                 print('Archived lead item:', item.item_id)
-            lead_item_crud.delete_by_item_ids(self.db, deleted)
+        AsyncNotionRepo.check(results)
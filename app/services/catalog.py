@@ -0,0 +1,142 @@
+import hashlib
+import json
+
+from app.core import settings
+from app.core.config import red
+from app.core.db import SessionLocal
+from app.crud import amo_product as amo_product_crud
+from app.crud.schemas import AmoProductCreate
+from app.repository.amocrm import AmoRepo
+from app.schemas import AMOProduct
+from app.schemas.notion import Item
+from app.utils.lock import ensure_lease
+
+
+class CatalogService:
+    """
+    Зеркало каталога amoCRM (12367) в таблице amo_product.
+
+    Обновляется нашими же записями в каталог (save/delete) и периодическим refresh,
+    который обходит каталог целиком и переписывает только изменившиеся строки.
+    Заодно служит индексом NID -> товар для get_product_by_nid.
+    """
+    # поля, которые из Notion и из amoCRM приходят в разном виде и в зеркале не хранятся
+    volatile_fields = {'amo_id', 'created', 'last_edited_time', 'linked_ids', 'subproducts_ids'}
+
+    @classmethod
+    def _to_row(cls, item: Item, payload_hash: str | None = None) -> AmoProductCreate:
+        data = item.model_dump(mode='json', exclude=cls.volatile_fields)
+        dict_str = json.dumps(data, sort_keys=True)
+        return AmoProductCreate(
+            amo_id=int(item.amo_id),
+            nid=item.nid,
+            notion_id=item.id or None,
+            data=data,
+            data_hash=hashlib.md5(dict_str.encode('utf-8')).hexdigest(),
+            payload_hash=payload_hash,
+        )
+
+    @staticmethod
+    def payload_hashes(items: list[Item]) -> dict[str, str]:
+        """Отпечатки payload для amoCRM по notion id, считать до загрузки фото."""
+        return {item.id: AMOProduct.payload_hash(item) for item in items}
+
+    @classmethod
+    def changed_payloads(cls, items: list[Item]) -> tuple[list[Item], dict[str, str]]:
+        """
+        Оставляет товары, чей payload для amoCRM отличается от последнего отправленного.
+        Возвращает их вместе с новыми отпечатками для save.
+        """
+        hashes = cls.payload_hashes(items)
+        with SessionLocal() as db:
+            sent = amo_product_crud.get_payload_hashes(db, list({int(item.amo_id) for item in items}))
+        changed = [item for item in items if sent.get(int(item.amo_id)) != hashes[item.id]]
+        return changed, hashes
+
+    @classmethod
+    def get_product_by_nid(cls, nid: str) -> Item | None:
+        return cls.get_products_by_nids([nid]).get(nid)
+
+    @classmethod
+    def get_products_by_nids(cls, nids: list[str]) -> dict[str, Item]:
+        """
+        Ищет товары каталога по NID одним запросом в зеркало, в amoCRM идёт только за промахами.
+        Промахи тоже запоминаются на AMOCRM_NID_MISS_TTL секунд. Пустое зеркало сначала заполняется.
+        """
+        nids = set(nids)
+        with SessionLocal() as db:
+            rows = amo_product_crud.get_by_nids(db, list(nids))
+            empty = len(rows) < len(nids) and amo_product_crud.is_empty(db)
+        if empty:
+            # первый запуск: один обход каталога вместо запроса в amoCRM на каждый NID
+            cls.refresh()
+            with SessionLocal() as db:
+                rows = amo_product_crud.get_by_nids(db, list(nids))
+        result = {
+            row.nid: Item(amo_id=str(row.amo_id), **row.data)
+            for row in rows
+        }
+        missed = [nid for nid in nids if nid not in result]
+        if not missed:
+            return result
+        known_misses = red.mget([cls._miss_key(nid) for nid in missed])
+        found = []
+        for nid, known_miss in zip(missed, known_misses):
+            if known_miss is not None:
+                continue
+            item = AmoRepo.get_product_by_nid(nid)
+            if item is None:
+                red.set(cls._miss_key(nid), '1', ex=settings.AMOCRM_NID_MISS_TTL)
+                continue
+            result[nid] = item
+            found.append(item)
+        cls.save(found)
+        return result
+
+    @staticmethod
+    def _miss_key(nid: str) -> str:
+        return f'amo-nid-miss-{nid}'
+
+    @classmethod
+    def save(cls, items: list[Item], payload_hashes: dict[str, str] | None = None):
+        """
+        Записывает товары в зеркало. payload_hashes - отпечатки только что отправленных в amoCRM
+        товаров, для товаров, прочитанных из amoCRM, отпечаток сбрасывается.
+        """
+        payload_hashes = payload_hashes or {}
+        rows = [cls._to_row(item, payload_hashes.get(item.id)) for item in items if item.amo_id]
+        with SessionLocal() as db:
+            amo_product_crud.upsert_many(db, rows)
+        if rows:
+            red.delete(*[cls._miss_key(row.nid) for row in rows])
+
+    @classmethod
+    def delete(cls, amo_ids: list[int | str]):
+        with SessionLocal() as db:
+            amo_product_crud.delete_by_amo_ids(db, [int(amo_id) for amo_id in amo_ids])
+
+    @classmethod
+    def refresh(cls):
+        """
+        Сверяет зеркало с каталогом amoCRM, подхватывая изменения, сделанные в обход нас.
+        У изменившихся товаров сбрасывается payload_hash, чтобы следующая синхронизация их перезаписала.
+        """
+        with SessionLocal() as db:
+            walk_started = amo_product_crud.now(db)
+        rows = {row.amo_id: row for row in map(cls._to_row, AmoRepo.get_all_products())}
+        ensure_lease()
+        with SessionLocal() as db:
+            hashes = amo_product_crud.get_hashes(db)
+            changed = [
+                row for amo_id, row in rows.items()
+                if hashes.get(amo_id) != row.data_hash
+            ]
+            amo_product_crud.upsert_many(db, changed)
+            # обход идёт под своей блокировкой, параллельно с sync_with_amo: товары, которые она
+            # создала и сохранила после начала обхода, в нём не видны, но удалять их нельзя
+            deleted = amo_product_crud.delete_by_amo_ids(
+                db,
+                [amo_id for amo_id in hashes if amo_id not in rows],
+                updated_before=walk_started,
+            )
+        print('Catalog mirror refreshed, changed:', len(changed), 'deleted:', deleted)
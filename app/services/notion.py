@@ -1,3 +1,5 @@
+import time
+
 from copy import deepcopy
 
 import pytz
@@ -9,7 +11,10 @@ from app.schemas.notion import *
 from ..core.config import red
 from ..repository.amocrm import AmoRepo
 from ..repository.notion import NotionRepo
+from ..repository.notion_async import AsyncNotionRepo
 from ..repository.tgbot import Alert
+from .catalog import CatalogService
+from ..utils.lock import LeaseLost, ensure_lease
 
 
 class NotionService:
@@ -17,10 +22,14 @@ class NotionService:
     amo_repo: AmoRepo = AmoRepo()
     client = Client(auth=settings.NOTION_SECRET)
     timezone = pytz.timezone('Asia/Almaty')
+    lead_hashes_key = 'sync-notion-lead-hashes'
+    # когда сделка последний раз приходила из Notion: по нему хеши давно не менявшихся сделок вытесняются
+    lead_hashes_seen_key = 'sync-notion-lead-hashes-seen'
+    lead_hashes_migrated_key = 'sync-notion-lead-hashes-migrated'
+    legacy_lead_hash_pattern = 'sync-notion-lead-hash-*'
 
     @classmethod
-    def load_updated_from_notion(cls, update_all: bool = False) -> list[Item]:
-        updated_at = cls.notion_repo.load_updated_at(update_all)
+    def load_updated_from_notion(cls, updated_at: str) -> list[Item]:
         print('load_updated_from_notion', updated_at)
         filter = {
             "and": [
@@ -45,22 +54,22 @@ class NotionService:
         return items
 
     @classmethod
-    def sync_with_amo(cls, update_all: bool = False):
+    def sync_with_amo(cls, update_all: bool = False, fence: int | None = None):
         try:
             if update_all:
                 Alert.info('`🔄 Полная синхронизация каталога в amoCRM...`')
             print('start sync', update_all)
             time_start = datetime.now(cls.timezone)
-            items = cls.load_updated_from_notion(update_all)
+            updated_at = cls.notion_repo.load_updated_at(update_all)
+            items = cls.load_updated_from_notion(updated_at)
 
-            amo_items = []
+            amo_items_ids = {}
             if len(items) != 0:
-                amo_items = cls.amo_repo.get_all_products()
-
-            amo_items_ids = {
-                amo_item.nid: amo_item
-                for amo_item in amo_items
-            }
+                if update_all:
+                    CatalogService.refresh()
+                # одним запросом в зеркало, промахи перепроверяются по API (с кешем промахов),
+                # чтобы не создать дубль
+                amo_items_ids = CatalogService.get_products_by_nids([item.nid for item in items])
 
             items_for_update = []
             items_for_delete = []
@@ -83,65 +92,96 @@ class NotionService:
                     items_for_update.append(deepcopy(item))
 
             if len(items) != 0:
+                # аренда могла истечь, пока грузили Notion - пишем в amoCRM только под своей блокировкой
+                ensure_lease()
                 # обработка тех которые надо удалить
                 items_for_delete, items_for_update, items_for_update_status_off = cls.enrich_deleted_items(
                     items_for_delete,
                     items_for_update,
                     items_for_update_status_off,
                 )
-                cls.amo_repo.delete_from_catalog([i.amo_id for i in items_for_delete])
+                if cls.amo_repo.delete_from_catalog([i.amo_id for i in items_for_delete]):
+                    CatalogService.delete([i.amo_id for i in items_for_delete])
                 items_for_update_status_off.extend(items_for_delete)
 
                 # проставляем статусы "удалено" в notion
-                for item in items_for_update_status_off:
-                    cls.notion_repo.set_deleted(item)
+                if items_for_update_status_off:
+                    AsyncNotionRepo.check(AsyncNotionRepo.run(
+                        lambda repo: repo.set_deleted_many(items_for_update_status_off),
+                    ))
 
-                # создание новых
-                cls.amo_repo.add_products(items_for_create)
+                # создание новых, фото качаем только для реально записываемых товаров
+                ensure_lease()
+                create_hashes = CatalogService.payload_hashes(items_for_create)
+                Item.prefetch_photos(items_for_create)
+                CatalogService.save(cls.amo_repo.add_products(items_for_create), create_hashes)
 
                 # обновление старых
                 # сначала ищем связанные карточки в notion
                 items_for_update.extend(cls.enrich_updated_items(items, items_for_update))
-                cls.amo_repo.patch_items(items_for_update)
+                # патчим только товары, у которых изменилось то, что уходит в amoCRM
+                edited = len(items_for_update)
+                changed, update_hashes = CatalogService.changed_payloads(items_for_update)
+                if not update_all:
+                    items_for_update = changed
+                print('Payload unchanged, skipped:', edited - len(items_for_update))
+                Item.prefetch_photos(items_for_update)
+                ensure_lease()
+                CatalogService.save(cls.amo_repo.patch_items(items_for_update), update_hashes)
 
             # сохраняем время последнего обновления
             time_finish = datetime.now(cls.timezone)
-            cls.notion_repo.set_updated_at(time_finish)
+            if not cls.notion_repo.set_updated_at(time_finish,
+                                                  expected=None if update_all else updated_at,
+                                                  fence=fence):
+                print('Items watermark was moved by another sync, keeping it')
 
             print('Time elapsed:', time_finish - time_start)
             print('Updated:', len(items_for_update))
             print('Created:', len(items_for_create))
             print('Deleted:', len(items_for_delete))
+            print('amoCRM rate limit:', cls.amo_repo.limiter.stats())
+            print('Notion items cache:', cls.notion_repo.items_cache.stats())
 
             if update_all:
                 Alert.info('`✅ Полная синхронизация каталога в amoCRM успешно завершена`')
+        except LeaseLost as ex:
+            print('Sync aborted:', ex)
         except Exception as ex:
             Alert.critical(f'`❌ Ошибка синхронизации каталога с amoCRM:\n\n{ex}`')
-        red.delete('sync-running')
 
     @classmethod
-    def sync_leads(cls, update_all: bool = False):
+    def sync_leads(cls, update_all: bool = False, fence: int | None = None):
         try:
             if update_all:
                 Alert.info_lead('`🔄 Полная синхронизация лидов в amoCRM...`')
             print('start sync leads', update_all)
             time_start = datetime.now(cls.timezone)
+            cls.migrate_lead_hashes()
 
-            leads = cls.notion_repo.load_updated_leads(update_all)
+            leads = cls.notion_repo.load_updated_leads(update_all, fence)
 
-            update_leads = []
-            for lead in leads:
-                old_hash = red.get(f'sync-notion-lead-hash-{lead.id}')
-                new_hash = lead.hash()
-                if old_hash is not None:
-                    if old_hash.decode('utf-8') == new_hash:
-                        continue
-                red.set(f'sync-notion-lead-hash-{lead.id}', new_hash)
-                update_leads.append(lead)
+            # хеши всех сделок в одном redis-хеше: одно чтение и одна запись на прогон
+            new_hashes = {lead.id: lead.hash() for lead in leads}
+            old_hashes = red.hmget(cls.lead_hashes_key, list(new_hashes)) if new_hashes else []
+            update_leads = [
+                lead for lead, old_hash in zip(leads, old_hashes)
+                if old_hash is None or old_hash.decode('utf-8') != new_hashes[lead.id]
+            ]
 
             print('updating leads:', [lead.id for lead in update_leads])
-            if len(update_leads) != 0:
-                AmoRepo.update_leads(leads)
+            ensure_lease()
+            updated = AmoRepo.update_leads(update_leads)
+
+            now = time.time()
+            with red.pipeline() as pipe:
+                # хеш запоминаем только после успешной отправки, иначе сделка повторится в следующий прогон
+                if updated:
+                    pipe.hset(cls.lead_hashes_key, mapping={lead.id: new_hashes[lead.id] for lead in updated})
+                if new_hashes:
+                    pipe.zadd(cls.lead_hashes_seen_key, {lead_id: now for lead_id in new_hashes})
+                pipe.execute()
+            cls.evict_lead_hashes(now - settings.NOTION_LEAD_HASH_TTL)
 
             time_finish = datetime.now(cls.timezone)
             print('finish sync leads, time elapsed:', time_finish - time_start)
@@ -149,26 +189,76 @@ class NotionService:
             if update_all:
                 Alert.info_lead('`✅ Полная синхронизация лидов в amoCRM успешно завершена`')
 
+        except LeaseLost as ex:
+            print('Sync leads aborted:', ex)
         except Exception as ex:
             Alert.critical(f'`❌ Ошибка синхронизации лидов с amoCRM:\n\n{ex}`')
-        red.delete('sync-leads-running')
+
+    @classmethod
+    def evict_lead_hashes(cls, seen_before: float, batch: int = 1000):
+        """
+        Удаляет хеши сделок, которые не приходили из Notion с seen_before. Если такая сделка
+        изменится снова, она один раз уйдёт в amoCRM без сравнения хеша.
+        """
+        while stale := red.zrangebyscore(cls.lead_hashes_seen_key, '-inf', seen_before, start=0, num=batch):
+            with red.pipeline() as pipe:
+                pipe.hdel(cls.lead_hashes_key, *stale)
+                pipe.zrem(cls.lead_hashes_seen_key, *stale)
+                pipe.execute()
+
+    @classmethod
+    def migrate_lead_hashes(cls, batch: int = 1000):
+        """
+        Однократно удаляет старые ключи sync-notion-lead-hash-{id} без TTL и отмечает уже
+        сохранённые хеши как увиденные сейчас, чтобы на них тоже действовало вытеснение.
+        """
+        if red.exists(cls.lead_hashes_migrated_key):
+            return
+        keys = []
+        for key in red.scan_iter(match=cls.legacy_lead_hash_pattern, count=batch):
+            keys.append(key)
+            if len(keys) >= batch:
+                red.unlink(*keys)
+                keys = []
+        if keys:
+            red.unlink(*keys)
+        now = time.time()
+        if lead_ids := red.hkeys(cls.lead_hashes_key):
+            red.zadd(cls.lead_hashes_seen_key, {lead_id: now for lead_id in lead_ids}, nx=True)
+        red.set(cls.lead_hashes_migrated_key, 1)
+
+    @classmethod
+    def resolve_linked_items(cls, ids: set[str]) -> list[Item]:
+        """Загружает связанные карточки Notion параллельно и проставляет им amo_id одним запросом в зеркало."""
+        if not ids:
+            return []
+        linked_items = [
+            itm for itm in AsyncNotionRepo.run(lambda repo: repo.get_items_by_ids(list(ids)))
+            if itm is not None
+        ]
+        amo_items = CatalogService.get_products_by_nids([itm.nid for itm in linked_items])
+        result = []
+        for itm in linked_items:
+            amo_itm = amo_items.get(itm.nid)
+            if amo_itm is None:
+                continue
+            itm.amo_id = amo_itm.amo_id
+            result.append(itm)
+        return result
 
     @classmethod
     def enrich_updated_items(cls, items: list[Item], updated_items: list[Item]) -> list[Item]:
-        new_items = []
-        items_ids = [item.id for item in items]
-        for item in updated_items:
-            if item.linked_ids is not None:
-                for id in item.linked_ids:
-                    if id not in items_ids:
-                        itm = cls.notion_repo.get_item_by_id(id)
-                        amo_itm = cls.amo_repo.get_product_by_nid(itm.nid)
-                        if amo_itm is None:
-                            continue
-                        itm.amo_id = amo_itm.amo_id
-                        if itm is not None and itm.catalog_status != ItemStatus.off:
-                            new_items.append(itm)
-        return new_items
+        items_ids = {item.id for item in items}
+        linked_ids = {
+            id
+            for item in updated_items
+            for id in item.linked_ids or []
+            if id not in items_ids
+        }
+        return [
+            itm for itm in cls.resolve_linked_items(linked_ids)
+            if itm.catalog_status != ItemStatus.off
+        ]
 
     @classmethod
     def enrich_deleted_items(cls,
@@ -177,16 +267,13 @@ class NotionService:
                              items_for_update_status_off: list[Item],
                              ) -> tuple[list[Item], list[Item], list[Item]]:
         # добавляем подтовары в списки удаления и обновления статусов
-        new_items_for_delete = []
-        for item in items_for_delete:
-            if item.subproducts_ids is not None:
-                for id in item.linked_ids:
-                    sub_itm = cls.notion_repo.get_item_by_id(id)
-                    if sub_itm is not None:
-                        amo_itm = cls.amo_repo.get_product_by_nid(sub_itm.nid)
-                        if amo_itm is not None:
-                            sub_itm.amo_id = amo_itm.amo_id
-                            new_items_for_delete.append(sub_itm)
+        linked_ids = {
+            id
+            for item in items_for_delete
+            if item.subproducts_ids is not None
+            for id in item.linked_ids
+        }
+        new_items_for_delete = cls.resolve_linked_items(linked_ids)
         items_for_delete.extend(new_items_for_delete)
 
         # # добавляем в обновление статусов
@@ -194,7 +281,7 @@ class NotionService:
 
         # исключаем подтовары из списков на обновление
         new_items_for_update = []
-        ids = [i.nid for i in new_items_for_delete]
+        ids = {i.nid for i in new_items_for_delete}
         for item in items_for_update:
             if item.nid not in ids:
                 new_items_for_update.append(item)
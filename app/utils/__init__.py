@@ -1 +1 @@
-from .cache import cache_by_params
+from .cache import cache_by_params, TTLCache
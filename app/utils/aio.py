@@ -0,0 +1,44 @@
+import asyncio
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Coroutine, TypeVar
+
+T = TypeVar('T')
+
+
+def run_sync(coro: Coroutine[Any, Any, T]) -> T:
+    """
+    run_sync выполняет корутину из синхронного кода и возвращает её результат
+
+    Если в текущем потоке уже крутится event loop (синхронный код вызван из async хендлера),
+    корутина выполняется в отдельном потоке со своим loop.
+
+    :param coro: корутина
+    :return:
+    """
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coro)
+    with ThreadPoolExecutor(1) as pool:
+        return pool.submit(asyncio.run, coro).result()
+
+
+async def watch_loop_lag(interval: float, threshold: float, on_lag) -> None:
+    """
+    watch_loop_lag следит, не блокирует ли кто-то event loop
+
+    Каждые interval секунд сравнивает фактическую паузу с ожидаемой. Если loop проснулся
+    позже чем на threshold, значит его держал синхронный код, вызывается on_lag(lag).
+
+    :param interval: период проверки, с
+    :param threshold: допустимое опоздание, с
+    :param on_lag: обработчик, получает опоздание в секундах
+    """
+    while True:
+        started = time.perf_counter()
+        await asyncio.sleep(interval)
+        lag = time.perf_counter() - started - interval
+        if lag > threshold:
+            on_lag(lag)
@@ -1,7 +1,10 @@
 import inspect
+import threading
+import time
 
+from collections import OrderedDict
 from functools import wraps
-from typing import Any
+from typing import Any, Hashable
 
 
 def _get_function_params_values_dict(func, args: tuple, kwargs: dict) -> dict:
@@ -50,3 +53,66 @@ def cache_by_params(*kw_params: str):
         return func_wrapper
 
     return decorator
+
+
+class TTLCache:
+    """
+    TTLCache потокобезопасный LRU-кеш ограниченного размера с временем жизни записей
+
+    cache = TTLCache(maxsize=1000, ttl=600)
+    cache.set('key', value)
+    cache.get('key')  # value, пока запись не устарела и не вытеснена
+    cache.stats()  # {'size': 1, 'hits': 1, 'misses': 0, 'hit_rate': 1.0}
+
+    :param maxsize: максимальное количество записей
+    :param ttl: время жизни записи в секундах
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self._data[key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def peek(self, key: Hashable, default: Any = None) -> Any:
+        """Как get, но без учёта в статистике и без продления LRU."""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                return default
+            return entry[1]
+
+    def set(self, key: Hashable, value: Any):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key: Hashable):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def stats(self) -> dict[str, int | float]:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'size': len(self._data),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / total if total else 0,
+            }
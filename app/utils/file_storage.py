@@ -1,21 +1,110 @@
-from fastapi import HTTPException
-import requests
+import hashlib
 import os
+import tempfile
+import threading
+
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from fastapi import HTTPException
 
 from app.core import settings
+from app.core.config import red
+from app.utils.http import make_session
+
+session = make_session(settings.MEDIA_POOL_SIZE)
 
-UPLOAD_DIR = 'media'
+
+def _cache_key(filename: str) -> str:
+    return f'media-cache-{filename}'
 
 
 def save_file_from_url(url: str, filename: str) -> str:
-    if not os.path.exists(UPLOAD_DIR):
-        os.makedirs(UPLOAD_DIR, exist_ok=True)
+    """
+    save_file_from_url зеркалирует картинку в UPLOAD_DIR и возвращает её публичную ссылку
+
+    Для каждого файла в redis запоминаются источник (ссылка без подписи), ETag/Last-Modified
+    и sha256 содержимого. Если источник не поменялся, отправляется условный запрос, и при 304
+    файл не скачивается. Иначе картинка стримится во временный файл и атомарно заменяет
+    старую, только если содержимое действительно изменилось.
+    """
+    os.makedirs(settings.UPLOAD_DIR, exist_ok=True)
     url = url.replace('&amp;', '&')
-    response = requests.get(url, stream=True)
     file_path = os.path.join(settings.UPLOAD_DIR, filename)
-    if response.status_code != 200:
-        raise HTTPException(status_code=response.status_code,
-                            detail=f'Ошибка при загрузке изображения:{response.text}\nURL:{url}')
-    with open(file_path, "wb") as out_file:
-        out_file.write(response.content)
-    return f'https://api.cehcom.kz/{file_path}'
+    public_url = f'https://api.cehcom.kz/{file_path}'
+    key = _cache_key(filename)
+    source = url.split('?')[0]
+
+    meta = {k.decode(): v.decode() for k, v in red.hgetall(key).items()}
+    headers = {}
+    if meta.get('source') == source and os.path.exists(file_path):
+        if meta.get('etag'):
+            headers['If-None-Match'] = meta['etag']
+        if meta.get('last_modified'):
+            headers['If-Modified-Since'] = meta['last_modified']
+
+    with session.get(url, headers=headers, stream=True, timeout=(5, 60)) as response:
+        if response.status_code == 304:
+            return public_url
+        if response.status_code != 200:
+            raise HTTPException(status_code=response.status_code,
+                                detail=f'Ошибка при загрузке изображения:{response.text}\nURL:{url}')
+        fd, tmp_path = tempfile.mkstemp(dir=settings.UPLOAD_DIR, prefix=f'.{filename}.', suffix='.tmp')
+        digest = hashlib.sha256()
+        try:
+            with os.fdopen(fd, 'wb') as out_file:
+                for chunk in response.iter_content(chunk_size=64 * 1024):
+                    digest.update(chunk)
+                    out_file.write(chunk)
+            if meta.get('sha256') == digest.hexdigest() and os.path.exists(file_path):
+                os.remove(tmp_path)
+            else:
+                os.chmod(tmp_path, 0o644)
+                os.replace(tmp_path, file_path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    with red.pipeline() as pipe:
+        pipe.delete(key)
+        pipe.hset(key, mapping={
+            'source': source,
+            'etag': response.headers.get('ETag', ''),
+            'last_modified': response.headers.get('Last-Modified', ''),
+            'sha256': digest.hexdigest(),
+        })
+        pipe.execute()
+    return public_url
+
+
+class MediaPool:
+    """
+    MediaPool фоновая загрузка картинок через save_file_from_url в ограниченном пуле потоков
+
+    Загрузку заранее ставят в очередь (submit), а результат забирает (result) тот,
+    кому нужна итоговая ссылка. Если файл в очередь не ставили, result качает его сам.
+    Повторная постановка того же файла, пока он ещё качается, не создаёт второй загрузки.
+    """
+
+    def __init__(self, workers: int):
+        self._executor = ThreadPoolExecutor(workers, thread_name_prefix='media')
+        self._futures: dict[str, Future] = {}
+        self._lock = threading.Lock()
+
+    def submit(self, url: str, filename: str) -> Future:
+        with self._lock:
+            future = self._futures.get(filename)
+            if future is None or future.done():
+                future = self._executor.submit(save_file_from_url, url, filename)
+                self._futures[filename] = future
+            return future
+
+    def result(self, url: str, filename: str) -> str:
+        with self._lock:
+            future = self._futures.pop(filename, None)
+        if future is None:
+            return save_file_from_url(url, filename)
+        return future.result()
+
+
+media_pool = MediaPool(settings.MEDIA_WORKERS)
@@ -0,0 +1,74 @@
+from urllib.parse import unquote_plus
+
+
+def _unquote_pairs(body: str) -> list[tuple[str, str]]:
+    pairs = []
+    for pair in body.split('&'):
+        key, sep, value = pair.partition('=')
+        if sep and value:
+            pairs.append((key, value))
+    if '%00' in body or '\x00' in body:
+        return [(unquote_plus(k, errors='replace'), unquote_plus(v, errors='replace')) for k, v in pairs]
+    # декодируем всё одним вызовом: \x00 в теле может появиться только из %00
+    flat = unquote_plus('\x00'.join(f'{k}\x00{v}' for k, v in pairs), errors='replace').split('\x00')
+    return list(zip(flat[::2], flat[1::2]))
+
+
+def parse_form(body: bytes | str) -> dict:
+    """
+    Разбор form-urlencoded тела хука amoCRM в один проход сразу во вложенный словарь.
+
+    `leads[update][0][custom_fields][1][id]=...` раскладывается в
+    `{'leads': {'update': {0: {'custom_fields': {1: {'id': ...}}}}}}`: числовые сегменты
+    становятся int-ключами словаря, списков не бывает. Повторяющийся ключ даёт список
+    значений на месте первого вхождения, пустые значения пропускаются - как у parse_qs.
+    """
+    if isinstance(body, bytes):
+        body = body.decode('utf-8')
+
+    result = {}
+    # узлы по префиксу ключа: у соседних полей одной сделки путь до родителя общий
+    parents = {'': result}
+    for key, value in _unquote_pairs(body):
+        start = key.rfind('[')
+        if start == -1:
+            prefix, last = '', key
+        else:
+            prefix, last = key[:start], key[start + 1:].rstrip(']')
+
+        node = parents.get(prefix)
+        if node is None:
+            node = parents[prefix] = _walk(result, prefix)
+
+        if last.isdigit():
+            last = int(last)
+        current = node.get(last)
+        if isinstance(current, str):
+            node[last] = [current, value]
+        elif isinstance(current, list):
+            current.append(value)
+        else:
+            if isinstance(current, dict):
+                # узел затирается значением, закешированные пути под ним больше не валидны
+                parents = {'': result}
+            node[last] = value
+    return result
+
+
+def _walk(root: dict, prefix: str) -> dict:
+    start = prefix.find('[')
+    if start == -1:
+        parts = [prefix]
+    else:
+        parts = [prefix[:start], *prefix[start + 1:].rstrip(']').split('][')]
+
+    node = root
+    for part in parts:
+        if part.isdigit():
+            node = node.setdefault(int(part), {})
+        else:
+            child = node.get(part)
+            if not isinstance(child, dict):
+                child = node[part] = {}
+            node = child
+    return node
@@ -0,0 +1,29 @@
+import requests
+
+from requests.adapters import HTTPAdapter
+
+
+def make_session(pool_size: int, headers: dict[str, str] | None = None) -> requests.Session:
+    """
+    make_session создаёт сессию с пулом keep-alive соединений на каждый хост,
+    чтобы последовательные запросы не платили за новый TCP+TLS handshake
+
+    :param pool_size: максимальное количество открытых соединений на хост
+    :param headers: заголовки, которые будут отправляться с каждым запросом
+    :return:
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=pool_size,
+        pool_maxsize=pool_size,
+        pool_block=True,
+    )
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    session.headers.update({
+        'Accept-Encoding': 'gzip, deflate',
+        'Connection': 'keep-alive',
+    })
+    if headers:
+        session.headers.update(headers)
+    return session
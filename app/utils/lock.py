@@ -0,0 +1,140 @@
+import threading
+import time
+
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from redis.client import Redis
+
+from app.core.logger import get_logger
+
+log = get_logger()
+
+_current_lease: ContextVar['LeaseLock | None'] = ContextVar('current_lease', default=None)
+
+
+class LeaseLost(Exception):
+    """Аренда LeaseLock истекла или перехвачена, задачу нужно прервать."""
+
+
+def ensure_lease():
+    """
+    Проверка между страницами долгих задач: если задача запущена через LeaseLock.run
+    и аренда потеряна, бросает LeaseLost. Вне LeaseLock.run ничего не делает.
+    """
+    lock = _current_lease.get()
+    if lock is not None and lock.lost.is_set():
+        raise LeaseLost(f'lease {lock.key} lost, token {lock.token}')
+
+
+class LeaseLock:
+    """
+    LeaseLock распределённая блокировка с арендой, общая для всех процессов, хранится в redis
+
+    Ключ ставится через SET NX PX на `ttl` секунд и продлевается фоновым heartbeat-потоком,
+    пока держатель жив. Если процесс упал, аренда истекает сама и задачу подхватывает другой узел.
+    Каждый захват получает возрастающий fencing token (`{key}-fence`), по которому общие ресурсы
+    отбрасывают запись от держателя, чья аренда уже истекла. Снимает блокировку только владелец.
+
+    lock = LeaseLock(red, 'sync-running', ttl=60)
+    if lock.acquire() is None:
+        return
+    lock.run(job, fence=lock.token)  # снимает блокировку по завершении
+
+    Ключ без срока жизни считается оставшимся от старого флага без TTL и снимается при захвате.
+    """
+
+    _acquire_script = '''
+        if redis.call('PTTL', KEYS[1]) == -1 then
+            redis.call('DEL', KEYS[1])
+        end
+        if redis.call('EXISTS', KEYS[1]) == 1 then
+            return false
+        end
+        local token = redis.call('INCR', KEYS[2])
+        redis.call('SET', KEYS[1], token, 'PX', ARGV[1])
+        return token
+    '''
+
+    _renew_script = '''
+        if redis.call('GET', KEYS[1]) == ARGV[1] then
+            return redis.call('PEXPIRE', KEYS[1], ARGV[2])
+        end
+        return 0
+    '''
+    _release_script = '''
+        if redis.call('GET', KEYS[1]) == ARGV[1] then
+            return redis.call('DEL', KEYS[1])
+        end
+        return 0
+    '''
+
+    def __init__(self, redis: Redis, key: str, ttl: float):
+        self.key = key
+        self.fence_key = f'{key}-fence'
+        self.ttl_ms = int(ttl * 1000)
+        self.token: int | None = None
+        self.lost = threading.Event()
+        self._acquire = redis.register_script(self._acquire_script)
+        self._renew = redis.register_script(self._renew_script)
+        self._release = redis.register_script(self._release_script)
+        self._redis = redis
+        self._stop = threading.Event()
+        self._heartbeat: threading.Thread | None = None
+
+    def acquire(self) -> int | None:
+        """Захватывает блокировку без ожидания. Возвращает fencing token или None, если она занята."""
+        token = self._acquire(keys=[self.key, self.fence_key], args=[self.ttl_ms])
+        if token is None:
+            return None
+        self.token = token
+        self._heartbeat = threading.Thread(target=self._keep_alive, name=f'lease-{self.key}', daemon=True)
+        self._heartbeat.start()
+        return token
+
+    def locked(self) -> bool:
+        """Занята ли блокировка кем-либо сейчас."""
+        return bool(self._redis.exists(self.key))
+
+    @contextmanager
+    def held(self, timeout: float, poll: float = 0.1):
+        """
+        Ждёт блокировку до timeout секунд и держит её внутри блока.
+        Если не дождались, бросает TimeoutError.
+        """
+        deadline = time.monotonic() + timeout
+        while self.acquire() is None:
+            if time.monotonic() >= deadline:
+                raise TimeoutError(f'lock {self.key} is busy')
+            time.sleep(poll)
+        try:
+            yield self.token
+        finally:
+            self.release()
+
+    def release(self):
+        self._stop.set()
+        if self.token is not None:
+            self._release(keys=[self.key], args=[self.token])
+
+    def run(self, func, *args, **kwargs):
+        """Выполняет func под блокировкой и снимает её, даже если func упала."""
+        reset = _current_lease.set(self)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _current_lease.reset(reset)
+            self.release()
+
+    def _keep_alive(self):
+        while not self._stop.wait(self.ttl_ms / 3000):
+            try:
+                renewed = self._renew(keys=[self.key], args=[self.token, self.ttl_ms])
+            except Exception as ex:
+                # redis недоступен - пробуем снова, пока аренда не истекла
+                log.warning(f'lease {self.key} renew failed: {ex}')
+                continue
+            if not renewed:
+                log.warning(f'lease {self.key} lost, token {self.token}')
+                self.lost.set()
+                return
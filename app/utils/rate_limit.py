@@ -0,0 +1,68 @@
+import time
+
+from redis.client import Redis
+
+
+class TokenBucket:
+    """
+    TokenBucket общий для всех процессов и потоков лимитер запросов, состояние хранится в redis
+
+    Каждый вызов acquire резервирует слот во времени (GCRA), поэтому ожидающие
+    обслуживаются в порядке обращения, а до `burst` запросов проходят без ожидания.
+    Время ожидания накапливается в redis-хеше `{key}-stats`.
+
+    limiter = TokenBucket(red, 'amo-rate-limit', rate=7, burst=7)
+    limiter.acquire()  # блокирует до получения токена
+    """
+
+    _script = '''
+        local now = redis.call('TIME')
+        now = tonumber(now[1]) * 1000000 + tonumber(now[2])
+        local interval = tonumber(ARGV[1])
+        local burst = tonumber(ARGV[2])
+        local tat = tonumber(redis.call('GET', KEYS[1]) or now)
+        if tat < now then
+            tat = now
+        end
+        local new_tat = tat + interval
+        local wait = new_tat - burst * interval - now
+        if wait < 0 then
+            wait = 0
+        end
+        redis.call('SET', KEYS[1], new_tat, 'PX', math.ceil((new_tat - now) / 1000) + 1000)
+        redis.call('HINCRBY', KEYS[2], 'acquired', 1)
+        if wait > 0 then
+            redis.call('HINCRBY', KEYS[2], 'waited', 1)
+            redis.call('HINCRBY', KEYS[2], 'wait_us', wait)
+        end
+        return wait
+    '''
+
+    def __init__(self, redis: Redis, key: str, rate: float, burst: int):
+        self.key = key
+        self.stats_key = f'{key}-stats'
+        self.interval = int(1_000_000 / rate)
+        self.burst = burst
+        self._reserve = redis.register_script(self._script)
+        self._redis = redis
+
+    def acquire(self) -> float:
+        """Ждёт свой токен и возвращает время ожидания в секундах."""
+        wait = self._reserve(
+            keys=[self.key, self.stats_key],
+            args=[self.interval, self.burst],
+        ) / 1_000_000
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    def stats(self) -> dict[str, float]:
+        data = {k.decode(): int(v) for k, v in self._redis.hgetall(self.stats_key).items()}
+        acquired = data.get('acquired', 0)
+        wait_seconds = data.get('wait_us', 0) / 1_000_000
+        return {
+            'acquired': acquired,
+            'waited': data.get('waited', 0),
+            'wait_seconds': wait_seconds,
+            'avg_wait_seconds': wait_seconds / acquired if acquired else 0,
+        }
@@ -0,0 +1,63 @@
+import os
+
+from redis.client import Redis
+
+
+class Watermark:
+    """
+    Watermark курсор синхронизации, общий для всех процессов, хранится в redis
+
+    advance сдвигает курсор, только если он не менялся с момента чтения (compare-and-set),
+    поэтому параллельный запуск на другой реплике не откатит курсор назад.
+    При первом обращении курсор берётся из переменной окружения `seed_env`
+    (перенос значений, которые раньше хранились в .env).
+
+    watermark = Watermark(red, 'sync-watermark-items', seed_env='LAST_UPDATED_AT')
+    last = watermark.get()
+    ...
+    watermark.advance(new, expected=last, fence=lock.token)
+    """
+
+    _script = '''
+        if ARGV[3] ~= '' then
+            local fence = tonumber(redis.call('GET', KEYS[2]) or '0')
+            if tonumber(ARGV[3]) < fence then
+                return 0
+            end
+            redis.call('SET', KEYS[2], ARGV[3])
+        end
+        local current = redis.call('GET', KEYS[1])
+        if ARGV[2] ~= '' and current and current ~= ARGV[2] then
+            return 0
+        end
+        redis.call('SET', KEYS[1], ARGV[1])
+        return 1
+    '''
+
+    def __init__(self, redis: Redis, key: str, seed_env: str | None = None):
+        self.key = key
+        self.fence_key = f'{key}-fence'
+        self.seed_env = seed_env
+        self._cas = redis.register_script(self._script)
+        self._redis = redis
+
+    def get(self) -> str | None:
+        value = self._redis.get(self.key)
+        if value is None and self.seed_env:
+            seed = os.getenv(self.seed_env)
+            if seed:
+                # nx: если курсор уже записал другой процесс, берём его значение
+                self._redis.set(self.key, seed, nx=True)
+                value = self._redis.get(self.key)
+        return value.decode('utf-8') if value is not None else None
+
+    def advance(self, value: str, expected: str | None = None, fence: int | None = None) -> bool:
+        """
+        Записывает value, если курсор всё ещё равен expected (или ещё не задан).
+        Без expected запись безусловная. С fence запись от держателя LeaseLock со старым
+        токеном отбрасывается. Возвращает False, если курсор не сдвинут.
+        """
+        return bool(self._cas(
+            keys=[self.key, self.fence_key],
+            args=[value, expected or '', fence if fence is not None else ''],
+        ))
@@ -0,0 +1,35 @@
+import threading
+import time
+
+from functools import partial
+from typing import Callable
+
+from app.core import settings
+from app.job.debounce import DebounceFlusher
+from app.job.hooks import HookWorker
+from app.repository.tgbot import Alert
+
+
+def supervise(factories: list[Callable[[], threading.Thread]]):
+    """Запускает потоки и перезапускает упавшие, как Scheduler перезапускает процессы задач."""
+    workers = [factory() for factory in factories]
+    for worker in workers:
+        worker.start()
+    while True:
+        time.sleep(5)
+        for i, worker in enumerate(workers):
+            if worker.is_alive():
+                continue
+            try:
+                Alert.critical(f'`❌ Поток {worker.name} завершился, перезапуск`')
+            except Exception as ex:
+                print('Worker alert error:', ex)
+            workers[i] = factories[i]()
+            workers[i].start()
+
+
+if __name__ == "__main__":
+    Alert.critical('`🟢 Обработчик хуков запущен.`')
+    factories = [partial(HookWorker, partition) for partition in range(settings.HOOKS_PARTITIONS)]
+    factories.extend(partial(DebounceFlusher, n) for n in range(settings.HOOKS_DEBOUNCE_WORKERS))
+    supervise(factories)
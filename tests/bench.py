@@ -0,0 +1,16 @@
+"""
+Замеры скорости против прежней реализации.
+
+Сравнения по времени зависят от загрузки машины, поэтому в обычном прогоне не участвуют:
+тесты с @benchmark запускаются только с `pytest --bench`, таблицы - через `python -m tests.<модуль>`.
+"""
+import timeit
+
+import pytest
+
+benchmark = pytest.mark.benchmark
+
+
+def best_time(func, number: int = 5, repeat: int = 7) -> float:
+    """Лучшее время одного вызова func() из repeat серий по number вызовов."""
+    return min(timeit.repeat(func, number=number, repeat=repeat)) / number
@@ -0,0 +1,42 @@
+import os
+
+import pytest
+
+# настройки без значений по умолчанию: тестам хватает заглушек, в сеть они не ходят
+for name, value in {
+    'AMOCRM_SUBDOMAIN': 'test',
+    'AMOCRM_CLIENT_ID': 'test',
+    'AMOCRM_CLIENT_SECRET': 'test',
+    'AMOCRM_REDIRECT_URL': 'http://localhost',
+    'NOTION_SECRET': 'test',
+    'TG_TOKEN': '1:test',
+    'POSTGRES_USER': 'test',
+    'POSTGRES_PASSWORD': 'test',
+    'POSTGRES_SERVER': 'localhost',
+    'POSTGRES_PORT': '5432',
+    'POSTGRES_ECHO': 'false',
+    'REDIS_HOST': 'localhost',
+}.items():
+    os.environ.setdefault(name, value)
+
+
+@pytest.fixture
+def anyio_backend():
+    return 'asyncio'
+
+
+def pytest_addoption(parser):
+    parser.addoption('--bench', action='store_true', help='запускать сравнения скорости (@benchmark)')
+
+
+def pytest_configure(config):
+    config.addinivalue_line('markers', 'benchmark: сравнение скорости с прежней реализацией, только с --bench')
+
+
+def pytest_collection_modifyitems(config, items):
+    if config.getoption('--bench'):
+        return
+    skip = pytest.mark.skip(reason='сравнение скорости, запускается с --bench')
+    for item in items:
+        if 'benchmark' in item.keywords:
+            item.add_marker(skip)
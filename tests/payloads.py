@@ -0,0 +1,121 @@
+"""
+Тела хуков amoCRM в том виде, в каком их присылает amoCRM: form-urlencoded,
+вложенность через квадратные скобки. Поля и их id взяты из реальных хуков сделок
+и элементов каталога товаров сделки.
+"""
+from urllib.parse import urlencode
+
+ACCOUNT = [
+    ('account[subdomain]', 'ceh'),
+    ('account[id]', '31415926'),
+    ('account[_links][self]', 'https://ceh.amocrm.ru'),
+]
+
+LEAD_FIELDS = [
+    (1450271, 'Статус производства', 'В работе'),
+    (1407255, 'Описание', 'Стойка ресепшн, шпон дуба & матовый лак; 2 шт.'),
+    (1421827, 'Дата начала', '1721250000'),
+    (1421829, 'Дата окончания', '1722459600'),
+    (1448499, 'Номер договора', 'Д-2024/07-15'),
+]
+
+ITEM_FIELDS = [
+    (1110355, 'Описание', 'Тумба подкатная, 3 ящика; шпон дуба & матовый лак'),
+    (1110357, 'Цена', '15400'),
+    (1450277, 'Количество', '2'),
+    (1450223, 'Цена агента', '12000'),
+    (1447011, 'Размеры', '400×500×600'),
+    (1450287, 'Примечание', 'Без ручек, push-to-open'),
+    (1450285, 'Количество в счёт', '2'),
+    (1450219, 'NID', 'CEH-{n}'),
+    (1450227, 'Фото', 'https://api.cehcom.kz/media/CEH-{n}.jpg'),
+]
+
+# у полей-дат amoCRM присылает значение без вложенного value: [values][0]=timestamp
+DATE_FIELDS = {1421827, 1421829}
+
+
+def _custom_fields(prefix: str, fields: list[tuple[int, str, str]], n: int) -> list[tuple[str, str]]:
+    pairs = []
+    for i, (field_id, name, value) in enumerate(fields):
+        value_key = '[values][0]' if field_id in DATE_FIELDS else '[values][0][value]'
+        pairs += [
+            (f'{prefix}[custom_fields][{i}][id]', str(field_id)),
+            (f'{prefix}[custom_fields][{i}][name]', name),
+            (f'{prefix}[custom_fields][{i}]{value_key}', value.format(n=n)),
+        ]
+    return pairs
+
+
+def lead_update_body(lead_id: int = 21040567, extra_fields: int = 0) -> bytes:
+    """Хук leads[update] на одну сделку, extra_fields добавляет текстовые поля сверх основных."""
+    prefix = 'leads[update][0]'
+    fields = LEAD_FIELDS + [
+        (1460000 + i, f'Поле {i}', f'значение {i} / 50% готово') for i in range(extra_fields)
+    ]
+    pairs = [
+        (f'{prefix}[id]', str(lead_id)),
+        (f'{prefix}[name]', 'Мебель для офиса на Ленина, 5'),
+        (f'{prefix}[status_id]', '142'),
+        (f'{prefix}[price]', '350000'),
+        (f'{prefix}[responsible_user_id]', '9052347'),
+        (f'{prefix}[last_modified]', '1721300000'),
+        (f'{prefix}[modified_user_id]', '9052347'),
+        (f'{prefix}[created_user_id]', '9052347'),
+        (f'{prefix}[date_create]', '1721200000'),
+        (f'{prefix}[pipeline_id]', '7000001'),
+        (f'{prefix}[account_id]', '31415926'),
+        *_custom_fields(prefix, fields, 0),
+        (f'{prefix}[created_at]', '1721200000'),
+        (f'{prefix}[updated_at]', '1721300000'),
+        *ACCOUNT,
+    ]
+    return urlencode(pairs).encode()
+
+
+def item_update_body(lead_id: int = 21040567,
+                     added: int = 0,
+                     updated: int = 1,
+                     deleted: int = 0) -> bytes:
+    """Хук catalogs[add|update|delete] по товарам сделки lead_id."""
+    pairs = []
+    n = 0
+    for action, count in (('add', added), ('update', updated)):
+        for i in range(count):
+            n += 1
+            prefix = f'catalogs[{action}][{i}]'
+            pairs += [
+                (f'{prefix}[id]', str(4100000 + n)),
+                (f'{prefix}[catalog_id]', '9035'),
+                (f'{prefix}[name]', f'Тумба подкатная №{n}'),
+                (f'{prefix}[created_at]', '1721200000'),
+                (f'{prefix}[updated_at]', '1721300000'),
+                *_custom_fields(prefix, [(1450239, 'Сделка', str(lead_id)), *ITEM_FIELDS], n),
+            ]
+    for i in range(deleted):
+        prefix = f'catalogs[delete][{i}]'
+        pairs += [
+            (f'{prefix}[id]', str(4200000 + i)),
+            (f'{prefix}[catalog_id]', '9035'),
+        ]
+    pairs += ACCOUNT
+    return urlencode(pairs).encode()
+
+
+def catalog_element(n: int = 1, lead_id: int = 21040567, extra_fields: int = 0) -> dict:
+    """Элемент каталога товаров сделки из API amoCRM, extra_fields добавляет поля сверх основных."""
+    fields = [
+        (1450239, 'Сделка', str(lead_id)),
+        *ITEM_FIELDS,
+        (1450221, 'Notion UID', f'notion-item-{n}'),
+        (1450635, 'Notion parent UID', 'notion-parent-1'),
+        *[(1460000 + i, f'Поле {i}', f'значение {i}') for i in range(extra_fields)],
+    ]
+    return {
+        'id': 4100000 + n,
+        'name': f'Тумба подкатная №{n}',
+        'custom_fields_values': [
+            {'field_id': field_id, 'field_name': name, 'values': [{'value': value.format(n=n)}]}
+            for field_id, name, value in fields
+        ],
+    }
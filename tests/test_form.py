@@ -0,0 +1,172 @@
+from urllib.parse import parse_qs, urlencode
+
+import pytest
+
+from app.schemas import AMODTProduct, parse_dt_product_update
+from app.schemas.lead import Lead, parse_lead_update, transform_custom_fields
+from app.utils.form import parse_form
+from tests.bench import benchmark, best_time
+from tests.payloads import item_update_body, lead_update_body
+
+
+def build_nested_dict(flat_dict):
+    """Разбор хуков до parse_form, эталон для сравнения результата и скорости."""
+    def set_nested_value(d, keys, value):
+        for key in keys[:-1]:
+            if key.isdigit():
+                key = int(key)
+                if isinstance(d, list):
+                    if len(d) <= key:
+                        d.extend([{}] * (key - len(d) + 1))
+                    d = d[key]
+                else:
+                    d[key] = d.get(key, {})
+                    d = d[key]
+            else:
+                if key not in d or not isinstance(d[key], dict):
+                    d[key] = {}
+                d = d[key]
+
+        last_key = keys[-1]
+        if last_key.isdigit():
+            last_key = int(last_key)
+            if isinstance(d, list):
+                if len(d) <= last_key:
+                    d.extend([None] * (last_key - len(d) + 1))
+                d[last_key] = value
+            else:
+                d[last_key] = value
+        else:
+            d[last_key] = value
+
+    nested_dict = {}
+    for key, value in flat_dict.items():
+        parts = key.replace(']', '').split('[')
+        set_nested_value(nested_dict, parts, value)
+    return nested_dict
+
+
+def legacy_parse(body: bytes) -> dict:
+    data = parse_qs(body.decode('utf-8'))
+    data = {k: v[0] if len(v) == 1 else v for k, v in data.items()}
+    return build_nested_dict(data)
+
+
+def legacy_lead_update(body: bytes) -> Lead | None:
+    update = legacy_parse(body).get('leads', {}).get('update', {})
+    if not update:
+        return None
+    update = update[0]
+    update['custom_fields'] = transform_custom_fields(update['custom_fields'])
+    return Lead(**update)
+
+
+def legacy_dt_product_update(body: bytes) -> tuple[list[AMODTProduct], list[AMODTProduct], list[int]]:
+    def to_product(item: dict) -> AMODTProduct:
+        item['custom_fields_values'] = [
+            {'field_id': field.pop('id'), 'values': [field]}
+            for field in item['custom_fields'].values()
+        ]
+        return AMODTProduct(**item)
+
+    catalogs = legacy_parse(body).get('catalogs', {})
+    return (
+        [to_product(item) for item in catalogs.get('add', {}).values()],
+        [to_product(item) for item in catalogs.get('update', {}).values()],
+        [int(item['id']) for item in catalogs.get('delete', {}).values()],
+    )
+
+
+BODIES = {
+    'lead': lead_update_body(),
+    'lead-many-fields': lead_update_body(extra_fields=150),
+    'items-update': item_update_body(),
+    'items-mixed': item_update_body(added=2, updated=12, deleted=3),
+    'items-delete': item_update_body(updated=0, deleted=4),
+    'repeated-and-blank': urlencode([
+        ('leads[update][0][id]', '1'),
+        ('leads[update][0][tags][]', 'a'),
+        ('leads[update][0][tags][]', 'b'),
+        ('leads[update][0][name]', ''),
+        ('leads[update][0][price]', '10%'),
+        ('account[id]', '2'),
+    ]).encode(),
+}
+
+
+@pytest.mark.parametrize('body', BODIES.values(), ids=BODIES.keys())
+def test_parse_form_matches_legacy(body):
+    assert parse_form(body) == legacy_parse(body)
+    assert parse_form(body.decode()) == legacy_parse(body)
+
+
+def test_parse_form_nested_shape():
+    data = parse_form(lead_update_body(lead_id=7))
+    lead = data['leads']['update'][0]
+    assert lead['id'] == '7'
+    assert lead['custom_fields'][0] == {
+        'id': '1450271',
+        'name': 'Статус производства',
+        'values': {0: {'value': 'В работе'}},
+    }
+    # у полей-дат значение лежит прямо в values
+    assert lead['custom_fields'][2]['values'] == {0: '1721250000'}
+    assert data['account']['_links']['self'] == 'https://ceh.amocrm.ru'
+
+
+@pytest.mark.parametrize('name', ['lead', 'lead-many-fields'])
+def test_parse_lead_update_matches_legacy(name):
+    lead = parse_lead_update(BODIES[name])
+    assert lead == legacy_lead_update(BODIES[name])
+    assert lead.hash() == legacy_lead_update(BODIES[name]).hash()
+    assert lead.p_status() == 'В работе'
+    assert lead.deadline() == ('2024-07-18', '2024-08-01')
+
+
+@pytest.mark.parametrize('name', ['items-update', 'items-mixed', 'items-delete'])
+def test_parse_dt_product_update_matches_legacy(name):
+    added, updated, deleted = parse_dt_product_update(BODIES[name])
+    legacy_added, legacy_updated, legacy_deleted = legacy_dt_product_update(BODIES[name])
+
+    assert deleted == legacy_deleted
+    assert len(added) == len(legacy_added)
+    assert len(updated) == len(legacy_updated)
+    for item, legacy in zip(added + updated, legacy_added + legacy_updated):
+        assert item.model_dump() == legacy.model_dump()
+        assert item.hash() == legacy.hash()
+        assert item.lead_id() == legacy.lead_id() == 21040567
+        assert item.get_nid() == legacy.get_nid()
+        assert item.get_count() == legacy.get_count() == 2
+        assert item.get_price() == legacy.get_price() == 15400
+
+
+def parse_time(func, body: bytes, number: int = 5) -> float:
+    return best_time(lambda: func(body), number)
+
+
+@benchmark
+def test_parse_faster_than_legacy():
+    # хук по сделке с 30 товарами: 30 * 10 полей, ~80 КБ
+    body = item_update_body(updated=30)
+    assert parse_time(parse_form, body) < parse_time(legacy_parse, body)
+    assert parse_time(parse_dt_product_update, body) < parse_time(legacy_dt_product_update, body)
+
+
+if __name__ == '__main__':
+    # python -m tests.test_form - сравнение скорости разбора со старым путём
+    for title, body in [
+        ('lead, 5 fields', lead_update_body()),
+        ('lead, 155 fields', lead_update_body(extra_fields=150)),
+        ('items, 1 product', item_update_body()),
+        ('items, 30 products', item_update_body(updated=30)),
+        ('items, 100 products', item_update_body(updated=100)),
+    ]:
+        if body.startswith(b'leads'):
+            new, old = parse_lead_update, legacy_lead_update
+        else:
+            new, old = parse_dt_product_update, legacy_dt_product_update
+        form_new, form_old = parse_time(parse_form, body, 50), parse_time(legacy_parse, body, 50)
+        hook_new, hook_old = parse_time(new, body, 50), parse_time(old, body, 50)
+        print(f'{title:<20} {len(body):>8} B  '
+              f'parse_form {form_new * 1e3:7.3f} ms vs {form_old * 1e3:7.3f} ms ({form_old / form_new:.2f}x)  '
+              f'hook {hook_new * 1e3:7.3f} ms vs {hook_old * 1e3:7.3f} ms ({hook_old / hook_new:.2f}x)')
@@ -0,0 +1,138 @@
+import shutil
+import ssl
+import subprocess
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import pytest
+import requests
+
+from app.utils.http import make_session
+from tests.bench import benchmark, best_time
+
+BODY = b'{"_embedded": {"elements": []}}'
+
+
+class Handler(BaseHTTPRequestHandler):
+    # HTTP/1.1, иначе сервер закрывает соединение после каждого ответа
+    protocol_version = 'HTTP/1.1'
+    # заголовки и тело уходят разными пакетами, с Nagle каждый ответ ждёт delayed ACK ~40 мс
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        # обработчик создаётся на каждое принятое соединение
+        self.server.connections += 1
+        super().setup()
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(BODY)))
+        self.end_headers()
+        self.wfile.write(BODY)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class Server:
+    """HTTPS-сервер на 127.0.0.1 с самоподписанным сертификатом, считает принятые соединения."""
+
+    def __init__(self, cert_dir: Path):
+        cert, key = cert_dir / 'cert.pem', cert_dir / 'key.pem'
+        subprocess.run([
+            'openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes', '-days', '1',
+            '-subj', '/CN=127.0.0.1', '-addext', 'subjectAltName=IP:127.0.0.1',
+            '-keyout', str(key), '-out', str(cert),
+        ], check=True, capture_output=True)
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        context.load_cert_chain(cert, key)
+
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.httpd.socket = context.wrap_socket(self.httpd.socket, server_side=True)
+        self.httpd.connections = 0
+        self.url = f'https://127.0.0.1:{self.httpd.server_port}/api/v4/catalogs/12367/elements'
+        self.cert = str(cert)
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+    @property
+    def connections(self) -> int:
+        return self.httpd.connections
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+@pytest.fixture(scope='module')
+def server(tmp_path_factory) -> Server:
+    if shutil.which('openssl') is None:
+        pytest.skip('openssl is required to issue a test certificate')
+    server = Server(tmp_path_factory.mktemp('tls'))
+    yield server
+    server.close()
+
+
+def fresh_get(server: Server):
+    """Запрос без сессии, как AmoRepo ходил в amoCRM раньше: своё соединение и handshake."""
+    response = requests.get(server.url, headers={'Content-Type': 'application/json'}, verify=server.cert)
+    response.raise_for_status()
+
+
+def pooled_get(session: requests.Session, server: Server):
+    response = session.get(server.url, verify=server.cert)
+    response.raise_for_status()
+
+
+def test_session_reuses_connection(server):
+    before = server.connections
+    with make_session(4) as session:
+        for _ in range(20):
+            pooled_get(session, server)
+    assert server.connections - before == 1
+
+
+def test_session_pool_is_bounded(server):
+    before = server.connections
+    with make_session(4) as session, ThreadPoolExecutor(16) as pool:
+        list(pool.map(lambda _: pooled_get(session, server), range(64)))
+    # pool_block: лишние потоки ждут свободное соединение, а не открывают новые
+    assert server.connections - before <= 4
+
+
+@benchmark
+def test_session_faster_than_fresh_connections(server):
+    with make_session(4) as session:
+        pooled_get(session, server)
+        pooled = best_time(lambda: pooled_get(session, server), 20)
+    assert pooled < best_time(lambda: fresh_get(server), 20)
+
+
+if __name__ == '__main__':
+    # python -m tests.test_http - стоимость запроса с пулом соединений и без
+    # сервер локальный, поэтому разница - только TCP+TLS handshake без сетевой задержки;
+    # до amoCRM каждый handshake добавляет ещё 2-3 RTT
+    import tempfile
+
+    with tempfile.TemporaryDirectory() as tmp:
+        server = Server(Path(tmp))
+        try:
+            for n in (1, 10, 100):
+                before = server.connections
+                fresh = best_time(lambda: fresh_get(server), n)
+                fresh_connections = server.connections - before
+
+                before = server.connections
+                with make_session(4) as session:
+                    pooled = best_time(lambda: pooled_get(session, server), n)
+                pooled_connections = server.connections - before
+
+                print(f'{n:>4} requests  '
+                      f'fresh {fresh * 1e3:7.3f} ms/req ({fresh_connections} conn)  '
+                      f'pooled {pooled * 1e3:7.3f} ms/req ({pooled_connections} conn)  '
+                      f'{fresh / pooled:.2f}x')
+        finally:
+            server.close()
@@ -0,0 +1,98 @@
+import asyncio
+import gc
+import time
+
+import httpx
+import pytest
+
+from app.core import get_async_db, settings
+from app.crud import lead_item_async as lead_item_async_crud
+from app.job.hooks import HookQueue
+from app.main import app
+from app.utils.aio import watch_loop_lag
+from tests.payloads import item_update_body, lead_update_body
+
+pytestmark = pytest.mark.anyio
+
+# пачка хуков, которая пришла одновременно: разобранные прямо в event loop,
+# они держат его дольше LOOP_LAG_THRESHOLD
+CONCURRENT = 16
+LEAD_BODY = lead_update_body(extra_fields=200)
+ITEMS_BODY = item_update_body(updated=20, deleted=5)
+
+
+async def max_loop_lag(coro) -> tuple[float, object]:
+    """Выполняет coro и возвращает наибольшее опоздание event loop за это время."""
+    lags = [0.0]
+    probe = asyncio.create_task(watch_loop_lag(0.005, 0, lags.append))
+    await asyncio.sleep(0.02)
+    try:
+        result = await coro
+        # даём пробе проснуться и записать опоздание, накопленное во время coro
+        await asyncio.sleep(0.02)
+    finally:
+        probe.cancel()
+    return max(lags), result
+
+
+@pytest.fixture
+def pushed(monkeypatch) -> list[tuple[str, int]]:
+    pushed = []
+
+    async def apush(type: str, body: bytes, key: int):
+        pushed.append((type, key))
+
+    async def get_by_item_ids(db, ids: list[int]):
+        return []
+
+    async def no_db():
+        yield None
+
+    monkeypatch.setattr(HookQueue, 'apush', apush)
+    monkeypatch.setattr(lead_item_async_crud, 'get_by_item_ids', get_by_item_ids)
+    app.dependency_overrides[get_async_db] = no_db
+    yield pushed
+    app.dependency_overrides.clear()
+
+
+@pytest.fixture
+def frozen_gc():
+    # полная сборка мусора по всем загруженным модулям сама стопорит loop на десятки мс,
+    # а проверяем мы хендлеры
+    gc.collect()
+    gc.freeze()
+    yield
+    gc.unfreeze()
+
+
+@pytest.fixture
+async def client():
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url='http://test') as client:
+        yield client
+
+
+async def test_probe_detects_blocking():
+    async def blocking():
+        time.sleep(settings.LOOP_LAG_THRESHOLD * 2)
+
+    lag, _ = await max_loop_lag(blocking())
+    assert lag > settings.LOOP_LAG_THRESHOLD
+
+
+@pytest.mark.parametrize('path, body, type', [
+    ('/lead-update', LEAD_BODY, HookQueue.lead_update),
+    ('/item-update', ITEMS_BODY, HookQueue.item_update),
+], ids=['lead-update', 'item-update'])
+async def test_hook_handlers_do_not_block_loop(client, pushed, frozen_gc, path, body, type):
+    requests = [
+        client.post(f'{settings.API_V1_STR}{path}', content=body, headers={
+            'Content-Type': 'application/x-www-form-urlencoded',
+        })
+        for _ in range(CONCURRENT)
+    ]
+    lag, responses = await max_loop_lag(asyncio.gather(*requests))
+
+    assert [response.status_code for response in responses] == [200] * CONCURRENT
+    assert pushed == [(type, 21040567)] * CONCURRENT
+    assert lag < settings.LOOP_LAG_THRESHOLD, f'event loop blocked for {lag:.3f}s'
@@ -0,0 +1,148 @@
+from unittest import mock
+
+import pytest
+
+from app.schemas import AMODTProduct, parse_dt_product_update
+from tests.bench import benchmark, best_time
+from tests.payloads import catalog_element, item_update_body
+
+
+class LegacyDTProduct(AMODTProduct):
+    """Аксессоры до индекса полей: каждый обходит custom_fields_values, эталон для сравнения."""
+
+    def _scan(self, field_id: int) -> list:
+        result = []
+        for field in self.custom_fields_values:
+            if int(field['field_id']) == field_id:
+                try:
+                    result.append(field['values'][0]['values'][0]['value'])
+                except KeyError:
+                    result.append(field['values'][0]['value'])
+        return result
+
+    def lead_id(self) -> int:
+        for field in self.custom_fields_values:
+            if int(field['field_id']) == 1450239:
+                try:
+                    return int(field['values'][0]['values'][0]['value'])
+                except KeyError:
+                    return int(field['values'][0]['value'])
+        return 0
+
+    def get_description(self):
+        return (self._scan(1110355) or [''])[-1]
+
+    def get_price(self):
+        values = self._scan(1110357)
+        return int(values[-1]) if values else None
+
+    def get_count(self):
+        values = self._scan(1450277)
+        return int(values[-1]) if values else None
+
+    def get_agent_price(self):
+        values = self._scan(1450223)
+        return int(values[-1]) if values else None
+
+    def get_sizes(self):
+        return (self._scan(1447011) or [''])[-1]
+
+    def get_note(self):
+        return (self._scan(1450287) or [''])[-1]
+
+    def get_count_for_invoice(self):
+        return int((self._scan(1450285) or [0])[-1])
+
+    def get_nid(self) -> str:
+        return (self._scan(1450219) or [''])[-1]
+
+    def get_notion_parent_uid(self) -> list:
+        return self._scan(1450635)
+
+    def get_notion_uid(self) -> list:
+        return self._scan(1450221)
+
+
+# get_photo не сравниваем: он зеркалирует фото по сети
+ACCESSORS = [
+    'lead_id', 'get_description', 'get_price', 'get_count', 'get_agent_price', 'get_sizes',
+    'get_note', 'get_count_for_invoice', 'get_nid', 'get_notion_parent_uid', 'get_notion_uid',
+]
+
+
+def read_fields(product: AMODTProduct) -> list:
+    """Все поля товара, которые читает выгрузка в notion."""
+    return [getattr(product, name)() for name in ACCESSORS]
+
+
+def test_accessors_match_legacy_for_api_elements():
+    element = catalog_element(n=3, extra_fields=20)
+    product = AMODTProduct(**element)
+    assert read_fields(product) == read_fields(LegacyDTProduct(**element))
+    assert read_fields(product) == [
+        21040567, 'Тумба подкатная, 3 ящика; шпон дуба & матовый лак', 15400, 2, 12000,
+        '400×500×600', 'Без ручек, push-to-open', 2, 'CEH-3', ['notion-parent-1'], ['notion-item-3'],
+    ]
+
+
+def test_accessors_match_legacy_for_hooks():
+    _, updated, _ = parse_dt_product_update(item_update_body(updated=5))
+    for product in updated:
+        legacy = LegacyDTProduct(**product.model_dump())
+        assert read_fields(product) == read_fields(legacy)
+
+
+def test_accessors_defaults_without_fields():
+    product = AMODTProduct(custom_fields_values=[])
+    assert read_fields(product) == read_fields(LegacyDTProduct(custom_fields_values=[]))
+    assert read_fields(product) == [0, '', None, None, None, '', '', 0, '', [], []]
+
+
+PHOTO = 'https://api.cehcom.kz/media/CEH-1.jpg'
+
+# выгрузка товара в notion: обновление созданного п-заказа и заполнение нового из черновика
+CONVERSIONS = {
+    'partial': lambda product: product.to_notion_partial_update(101, 7, 'lead-uid'),
+    'full': lambda product: product.to_notion_update(101, 7, 'lead-uid', 2),
+}
+
+
+@pytest.fixture
+def no_photo_mirror(monkeypatch):
+    # get_photo зеркалирует фото по сети, в конвертациях подменяем его у обеих реализаций
+    monkeypatch.setattr(AMODTProduct, 'get_photo', lambda self: PHOTO)
+
+
+@pytest.mark.parametrize('convert', CONVERSIONS.values(), ids=CONVERSIONS.keys())
+def test_conversions_match_legacy(no_photo_mirror, convert):
+    element = catalog_element(n=3, extra_fields=20)
+    assert convert(AMODTProduct(**element)) == convert(LegacyDTProduct(**element))
+    _, updated, _ = parse_dt_product_update(item_update_body(updated=3))
+    for product in updated:
+        assert convert(product) == convert(LegacyDTProduct(**product.model_dump()))
+
+
+def convert_time(model: type[AMODTProduct], element: dict, convert, number: int = 50) -> float:
+    # индекс строится при первом чтении поля, поэтому валидация товара входит в замер
+    return best_time(lambda: convert(model(**element)), number)
+
+
+@benchmark
+@pytest.mark.parametrize('extra_fields', [20, 60])
+@pytest.mark.parametrize('convert', CONVERSIONS.values(), ids=CONVERSIONS.keys())
+def test_conversions_faster_than_legacy(no_photo_mirror, convert, extra_fields):
+    element = catalog_element(extra_fields=extra_fields)
+    assert convert_time(AMODTProduct, element, convert) < convert_time(LegacyDTProduct, element, convert)
+
+
+if __name__ == '__main__':
+    # python -m tests.test_product - валидация товара и выгрузка в notion, с индексом полей и без
+    with mock.patch.object(AMODTProduct, 'get_photo', lambda self: PHOTO):
+        for extra_fields in (0, 20, 60, 150):
+            element = catalog_element(extra_fields=extra_fields)
+            row = f'{len(element["custom_fields_values"]):>4} fields'
+            for name, convert in CONVERSIONS.items():
+                new = convert_time(AMODTProduct, element, convert, 500)
+                old = convert_time(LegacyDTProduct, element, convert, 500)
+                row += f'  {name} {new * 1e6:7.1f} us vs scan {old * 1e6:7.1f} us ({old / new:.2f}x)'
+            print(row)